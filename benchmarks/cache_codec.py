@@ -0,0 +1,61 @@
+# coding: utf-8
+"""
+Compare payload size and decode time of the model cache codecs::
+
+    $ python benchmarks/cache_codec.py
+"""
+from __future__ import print_function
+
+import datetime
+import timeit
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from sqlalchemy.orm import configure_mappers
+from zerqu.models import User, Topic, Comment
+from zerqu.models.codecs import CACHE_CODECS
+
+NUMBER = 10000
+
+
+def create_instances():
+    now = datetime.datetime.utcnow()
+    user = User(
+        id=1, username='zerqu', email='zerqu@example.com', role=1,
+        name=u'ZERQU', description=u'A forum-like application',
+        created_at=now, updated_at=now,
+    )
+    content = u'\n\n'.join([u'Lorem ipsum dolor sit amet. ' * 20] * 30)
+    topic = Topic(title=u'Hello', content=content, user_id=1)
+    topic.id = 1
+    topic.tags = ['python', 'flask']
+    topic.created_at = topic.updated_at = now
+    comment = Comment(content=u'Nice topic @zerqu', topic_id=1, user_id=1)
+    comment.id = 1
+    comment.created_at = comment.updated_at = now
+    return [user, topic, comment]
+
+
+def main():
+    configure_mappers()
+    print('%-10s %-8s %10s %14s' % ('model', 'codec', 'bytes', 'decode (us)'))
+    for obj in create_instances():
+        model = type(obj)
+        for name in sorted(CACHE_CODECS):
+            codec = CACHE_CODECS[name]
+            payload = pickle.dumps(
+                codec.dumps(model, obj), pickle.HIGHEST_PROTOCOL
+            )
+
+            def decode():
+                codec.loads(model, pickle.loads(payload))
+
+            cost = timeit.timeit(decode, number=NUMBER) / NUMBER * 1e6
+            print('%-10s %-8s %10d %14.2f' % (
+                model.__name__, name, len(payload), cost
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# coding: utf-8
+"""
+Measure CacheQuery.get_dict and get_many on warm cache, where every id
+is a hit, for batches of 20, 100 and 1000 ids::
+
+    $ python benchmarks/cache_get_dict.py
+"""
+from __future__ import print_function
+
+import datetime
+import timeit
+from zerqu import register_base
+from zerqu.app import create_app
+from zerqu.models import User
+from zerqu.models.base import _set_cached_many, CACHE_TIMES
+
+BATCHES = (20, 100, 1000)
+NUMBER = 200
+
+
+def create_users(count):
+    now = datetime.datetime.utcnow()
+    prefix = User.generate_cache_prefix('get')
+    users = {}
+    for i in range(1, count + 1):
+        user = User(
+            id=i, username='u%d' % i, email='u%d@example.com' % i,
+            role=1, created_at=now, updated_at=now,
+        )
+        users[prefix + str(i)] = user
+    _set_cached_many(User, users, CACHE_TIMES['get'])
+
+
+def main():
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'ZERQU_CACHE_TYPE': 'simple',
+        'SECRET_KEY': 'benchmark',
+    })
+    register_base(app)
+
+    with app.app_context():
+        create_users(max(BATCHES))
+        print('%-8s %-10s %12s' % ('ids', 'method', 'cost (ms)'))
+        for count in BATCHES:
+            ids = list(range(1, count + 1))
+            for name in ('get_dict', 'get_many'):
+                func = getattr(User.cache, name)
+                cost = timeit.timeit(lambda: func(ids), number=NUMBER)
+                print('%-8d %-10s %12.3f' % (
+                    count, name, cost / NUMBER * 1000
+                ))
+
+
+if __name__ == '__main__':
+    main()
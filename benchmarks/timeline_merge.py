@@ -0,0 +1,82 @@
+# coding: utf-8
+"""
+Compare the SQL and the heap merge timeline engines for users following
+10, 100 and 1000 cafes. It requires PostgreSQL and Redis, and it drops
+all tables of the database::
+
+    $ DATABASE=postgresql://postgres@localhost/testing \\
+        python benchmarks/timeline_merge.py
+"""
+from __future__ import print_function
+
+import os
+import random
+import timeit
+from zerqu import register_base
+from zerqu.app import create_app
+from zerqu.models import db, Cafe, Topic, CafeTopic
+from zerqu.rec.inbox import ensure_cafe_lists
+from zerqu.rec.timeline import get_cafe_topic_ids, get_merged_topic_ids
+
+DATABASE = os.environ.get(
+    'DATABASE', 'postgresql://postgres@localhost/testing'
+)
+FOLLOWING = (10, 100, 1000)
+TOPICS_PER_CAFE = 30
+NUMBER = 20
+
+
+def create_data(count):
+    cafes = []
+    for i in range(count):
+        cafe = Cafe(name=u'cafe-%d' % i, slug='cafe-%d' % i, user_id=1)
+        db.session.add(cafe)
+        cafes.append(cafe)
+    db.session.flush()
+
+    for i in range(count * TOPICS_PER_CAFE):
+        topic = Topic(title=u'topic %d' % i, content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.flush()
+        cafe = random.choice(cafes)
+        db.session.add(CafeTopic(
+            cafe.id, topic.id, 1, status=CafeTopic.STATUS_PUBLIC
+        ))
+    db.session.commit()
+    return [cafe.id for cafe in cafes]
+
+
+def main():
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': DATABASE,
+        # measure the engines, not the page cache
+        'ZERQU_CACHE_TYPE': 'null',
+        'SECRET_KEY': 'benchmark',
+    })
+    register_base(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        cafe_ids = create_data(max(FOLLOWING))
+
+        print('%-10s %-8s %12s' % ('following', 'engine', 'cost (ms)'))
+        for count in FOLLOWING:
+            following = set(random.sample(cafe_ids, count))
+            ensure_cafe_lists(following)
+            cursor = get_cafe_topic_ids(following)[-1]
+            engines = [
+                ('sql', get_cafe_topic_ids), ('merge', get_merged_topic_ids),
+            ]
+            for name, func in engines:
+                def page():
+                    func(following)
+                    func(following, cursor)
+                cost = timeit.timeit(page, number=NUMBER)
+                print('%-10d %-8s %12.3f' % (
+                    count, name, cost / NUMBER / 2 * 1000
+                ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
 # coding: utf-8
 from __future__ import print_function
 import os
+from multiprocessing import Process
 
 from flask.ext.script import Manager
 
 from zerqu import create_app
-from zerqu.models.base import db
+from zerqu.models.base import db, iter_cache_counters, recount_cache_counter
 from zerqu.models.user import User
+from zerqu.models.topic import Topic, TopicStat
+from zerqu.libs.cache import redis
+from zerqu.libs.cachestats import load_snapshots
+from zerqu.rec.hot import compact_hot_topics, rescore_dirty_topics
+from zerqu.rec.backfill import backfill_inboxes, reset_checkpoints
 
 
 CONFIG = os.path.abspath('./local_config.py')
@@ -43,5 +49,147 @@ def adduser(username, password, role=User.ROLE_ACTIVE, **kwargs):
                   'and role {role}'.format(**userdata))
 
 
+@manager.command
+def cache_stats():
+    """Show cache hit ratio and latency per key family of all workers.
+    Usage::
+        $ python manage.py cache_stats
+    """
+    with app.app_context():
+        families, tiers = load_snapshots(redis)
+
+    row = '{:<24} {:>10} {:>10} {:>10} {:>8} {:>10} {:>10}'
+    print(row.format(
+        'family', 'calls', 'hits', 'misses', 'ratio', 'avg ms', 'avg bytes'
+    ))
+    for name in sorted(families, key=lambda k: -families[k]['misses']):
+        item = families[name]
+        print(row.format(
+            name, item['calls'], item['hits'], item['misses'],
+            item['hit_ratio'] or '-', item['avg_ms'] or '-',
+            item['avg_bytes'] or '-',
+        ))
+    for name in sorted(tiers):
+        print('{}: {}'.format(name, tiers[name]))
+
+
+@manager.command
+def compact_hot():
+    """Rescore topics read since last run and trim old entries of the hot
+    topics ranking, run it periodically.
+    Usage::
+        $ python manage.py compact_hot
+    """
+    with app.app_context():
+        rescored = rescore_dirty_topics()
+        count = compact_hot_topics()
+    print('Rescored {} topics'.format(rescored))
+    print('Removed {} topics from hot ranking'.format(count))
+
+
+@manager.command
+def reconcile_stats(batch=500):
+    """Recount stats of topics changed by deletes, run it periodically.
+    Usage::
+        $ python manage.py reconcile_stats [--batch=500]
+    """
+    with app.app_context():
+        count = TopicStat.reconcile(int(batch))
+    print('Recounted stats of {} topics'.format(count))
+
+
+@manager.command
+def recount_counters(batch=1000):
+    """Recount the counter hashes of all models with GROUP BY queries,
+    e.g. after redis lost its data.
+    Usage::
+        $ python manage.py recount_counters [--batch=1000]
+    """
+    with app.app_context():
+        for model, name in iter_cache_counters():
+            count = recount_cache_counter(model, name, int(batch))
+            print('{}.{}: recounted {} values'.format(
+                model.__name__, name, count
+            ))
+
+
+def _rebuild_stats_shard(shard, shards, chunk):
+    with app.app_context():
+        db.engine.dispose()
+        start, end = db.session.query(
+            db.func.min(Topic.id), db.func.max(Topic.id)
+        ).one()
+        count = 0
+        if start is not None:
+            ranges = range(start, end + 1, chunk)
+            for i in ranges[shard::shards]:
+                count += TopicStat.recount_range(i, i + chunk)
+    print('Shard {}/{}: recounted stats of {} topics'.format(
+        shard, shards, count
+    ))
+
+
+@manager.command
+def rebuild_stats(shards=1, shard=-1, chunk=5000):
+    """Recount likes, reads and comments of all topics, e.g. after redis
+    lost its data. Topic ids are split into ranges of chunk, which are
+    spread over shards processed in parallel.
+    Usage::
+        $ python manage.py rebuild_stats [--shards=4] [--chunk=5000]
+
+    :param shard: only process this shard, for running on several hosts.
+    """
+    shards, shard, chunk = int(shards), int(shard), int(chunk)
+    if shard >= 0:
+        return _rebuild_stats_shard(shard, shards, chunk)
+    _run_shards(_rebuild_stats_shard, shards, chunk=chunk)
+
+
+def _backfill_shard(shard, shards, **kwargs):
+    with app.app_context():
+        # connections must not be shared with the parent process
+        db.engine.dispose()
+        scanned, filled = backfill_inboxes(shard, shards, **kwargs)
+    print('Shard {}/{}: scanned {} users, filled {} inboxes'.format(
+        shard, shards, scanned, filled
+    ))
+
+
+@manager.command
+def backfill_timeline(shards=1, shard=-1, chunk=500, rate=0,
+                      force=False, restart=False):
+    """Fill fan-out timeline inboxes of users offline, resuming from the
+    last checkpoint of every shard.
+    Usage::
+        $ python manage.py backfill_timeline [--shards=4] [--shard=0]
+
+    :param shards: split users by id into shards processed in parallel.
+    :param shard: only process this shard, for running on several hosts.
+    :param rate: max users per second of every shard, 0 for no limit.
+    :param force: rebuild existing inboxes too.
+    :param restart: ignore checkpoints and start over.
+    """
+    shards, shard = int(shards), int(shard)
+    kwargs = dict(chunk=int(chunk), rate=float(rate), force=force)
+
+    if restart:
+        with app.app_context():
+            reset_checkpoints(shards)
+
+    if shard >= 0:
+        return _backfill_shard(shard, shards, **kwargs)
+    _run_shards(_backfill_shard, shards, **kwargs)
+
+
+def _run_shards(target, shards, **kwargs):
+    workers = []
+    for i in range(shards):
+        p = Process(target=target, args=(i, shards), kwargs=kwargs)
+        p.start()
+        workers.append(p)
+    for p in workers:
+        p.join()
+
+
 if __name__ == '__main__':
     manager.run()
@@ -1,9 +1,12 @@
 # coding: utf-8
 
+import base64
 import random
 from flask import json
 from zerqu.models import Cafe, CafeTopic, CafeMember
 from zerqu.models import db, User, Topic
+from zerqu.api import utils
+from zerqu.api.utils import encode_page_token
 from ._base import TestCase
 
 
@@ -292,6 +295,61 @@ class TestCafeMembers(TestCase, CafeMixin):
         rv = self.client.get('/api/cafes/hello/users?perpage=1')
         assert rv.status_code == 400
 
+    def test_list_cafe_users_after_token(self):
+        total = 60
+        self.create_membership(Cafe.PERMISSION_PUBLIC, total)
+
+        url = '/api/cafes/hello/users?page=2'
+        value = json.loads(self.client.get(url).data)
+        expected = [o['user']['id'] for o in value['data']]
+
+        url = '/api/cafes/hello/users'
+        value = json.loads(self.client.get(url).data)
+        after = value['pagination']['after']
+        rv = self.client.get(url + '?after=' + after)
+        assert rv.status_code == 200
+        value = json.loads(rv.data)
+        assert value['pagination']['page'] == 2
+        assert [o['user']['id'] for o in value['data']] == expected
+
+        rv = self.client.get(url + '?after=invalid')
+        assert rv.status_code == 400
+
+        # a token of another order
+        token = encode_page_token(2, 'user_id', True, [1])
+        rv = self.client.get(url + '?after=' + token)
+        assert rv.status_code == 400
+
+        # tampered tokens
+        token = encode_page_token(2, 'user_id', False, ['a'])
+        rv = self.client.get(url + '?after=' + token)
+        assert rv.status_code == 400
+        token = base64.urlsafe_b64encode(b'{"a": 1}').decode('ascii')
+        rv = self.client.get(url + '?after=' + token)
+        assert rv.status_code == 400
+
+    def test_list_cafe_users_deep_pages(self):
+        self.create_membership(Cafe.PERMISSION_PUBLIC, 60)
+        url = '/api/cafes/hello/users?perpage=10'
+        offset_pages = utils.OFFSET_PAGES
+        utils.OFFSET_PAGES = 2
+        try:
+            value = json.loads(self.client.get(url + '&page=2').data)
+            # page 3 can only be reached by the after token
+            assert value['pagination']['next'] is None
+            after = value['pagination']['after']
+
+            value = json.loads(self.client.get(url + '&after=' + after).data)
+            assert value['pagination']['page'] == 3
+            assert value['pagination']['prev'] == 2
+            after = value['pagination']['after']
+
+            value = json.loads(self.client.get(url + '&after=' + after).data)
+            assert value['pagination']['page'] == 4
+            assert value['pagination']['prev'] is None
+        finally:
+            utils.OFFSET_PAGES = offset_pages
+
 
 class TestCafeTopics(TestCase):
     def test_list_cafe_topics(self):
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+from zerqu.models import db, CafeMember, CafeTopic
+from zerqu.libs.cache import redis
+from zerqu.rec.inbox import LIST_EXPIRE, inbox_key, read_lists
+from zerqu.rec.backfill import iter_user_chunks, backfill_inboxes
+from zerqu.rec.backfill import checkpoint_key
+from ._base import TestCase
+
+
+class TestBackfill(TestCase):
+    def setUp(self):
+        super(TestBackfill, self).setUp()
+        keys = redis.keys('timeline:*')
+        if keys:
+            redis.delete(*keys)
+
+        for user_id in range(1, 6):
+            db.session.add(CafeMember(1, user_id, CafeMember.ROLE_SUBSCRIBER))
+        db.session.add(CafeMember(1, 6, CafeMember.ROLE_VISITOR))
+        db.session.add(CafeTopic(1, 10, 1, CafeTopic.STATUS_PUBLIC))
+        db.session.commit()
+
+    def test_chunks(self):
+        chunks = list(iter_user_chunks(size=2))
+        assert chunks == [[1, 2], [3, 4], [5]]
+        assert list(iter_user_chunks(start=3, size=2)) == [[4, 5]]
+
+    def test_shards(self):
+        assert list(iter_user_chunks(0, 2)) == [[2, 4]]
+        assert list(iter_user_chunks(1, 2)) == [[1, 3, 5]]
+
+    def test_backfill(self):
+        assert backfill_inboxes(chunk=2) == (5, 5)
+        assert read_lists([inbox_key(5)]) == [10]
+        assert redis.ttl(inbox_key(5)) > LIST_EXPIRE
+        assert not redis.exists(checkpoint_key(0, 1))
+
+        # existing inboxes are kept
+        assert backfill_inboxes(chunk=2) == (5, 0)
+
+    def test_resume_from_checkpoint(self):
+        redis.set(checkpoint_key(1, 2), 1)
+        assert backfill_inboxes(1, 2, chunk=1) == (2, 2)
+        assert not redis.exists(inbox_key(1))
+        assert redis.exists(inbox_key(3))
+        assert redis.exists(inbox_key(5))
+        assert not redis.exists(inbox_key(2))
@@ -0,0 +1,167 @@
+# coding: utf-8
+
+from zerqu.models import db, WebPage, Topic, CafeTopic
+from zerqu.models.base import CacheBatch, _namespace_prefix, _counter_key
+from zerqu.models.base import recount_cache_counter, FILL_COUNTER_SCRIPT
+from zerqu.libs.cache import LocalCache, get_round_trips, redis
+from ._base import TestCase
+
+
+class TestCacheQuery(TestCase):
+    def test_get_dict_keys(self):
+        # uuid starts with characters in the cache prefix
+        uuids = ['db0d', 'abcd', 'ffff']
+        for uuid in uuids:
+            db.session.add(WebPage(uuid, 'http://lepture.com/%s' % uuid))
+        db.session.commit()
+
+        for i in range(2):
+            rv = WebPage.cache.get_dict(uuids[::-1])
+            assert list(rv.keys()) == uuids[::-1]
+            assert rv['db0d'].uuid == 'db0d'
+
+    def test_get_many_missing(self):
+        topic = Topic(title=u'hello', content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.commit()
+
+        for i in range(2):
+            rv = Topic.cache.get_many([topic.id, 404])
+            assert [t.id for t in rv] == [topic.id]
+            assert Topic.cache.get_many([404], clean=False) == [None]
+
+    def test_batch(self):
+        topic = Topic(title=u'hello', content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.add(WebPage('abcd', 'http://lepture.com/abcd'))
+        db.session.commit()
+
+        for i in range(2):
+            batch = CacheBatch()
+            topics = Topic.cache.get_dict([topic.id, 404], batch=batch)
+            pages = WebPage.cache.get_dict(['abcd'], batch=batch)
+            assert not topics
+            batch.execute()
+            assert topics[str(topic.id)].title == u'hello'
+            assert topics['404'] is None
+            assert pages['abcd'].uuid == 'abcd'
+
+    def test_local_cache_instances(self):
+        self.app.extensions['zerqu_local_cache'] = LocalCache()
+        topic = Topic(title=u'hello', content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.commit()
+
+        a = Topic.cache.get(topic.id)
+        b = Topic.cache.get(topic.id)
+        assert a is not b
+        a.title = u'changed'
+        assert Topic.cache.get(topic.id).title == u'hello'
+
+    def test_tombstone_cleared_on_insert(self):
+        assert WebPage.cache.get('abcd') is None
+        assert WebPage.cache.get_dict(['abcd'])['abcd'] is None
+        assert WebPage.cache.filter_first(uuid='abcd') is None
+
+        db.session.add(WebPage('abcd', 'http://lepture.com/abcd'))
+        db.session.commit()
+
+        assert WebPage.cache.get('abcd').uuid == 'abcd'
+        assert WebPage.cache.get_dict(['abcd'])['abcd'].uuid == 'abcd'
+        assert WebPage.cache.filter_first(uuid='abcd').uuid == 'abcd'
+
+    def test_round_trips(self):
+        with self.app.test_request_context():
+            assert get_round_trips() == 0
+            assert WebPage.cache.get('abcd') is None
+            count = get_round_trips()
+            assert count > 0
+            # served by the identity map of the request
+            assert WebPage.cache.get('abcd') is None
+            assert get_round_trips() == count
+
+    def test_rollback_drops_write_back(self):
+        count = WebPage.cache.filter_count()
+        db.session.add(WebPage('abcd', 'http://lepture.com/abcd'))
+        db.session.flush()
+        assert 'cache_write_back' in db.session.info
+
+        db.session.rollback()
+        assert 'cache_write_back' not in db.session.info
+        assert WebPage.cache.filter_count() == count
+        assert WebPage.cache.get('abcd') is None
+
+    def test_namespace_version(self):
+        with self.app.test_request_context():
+            prefix = _namespace_prefix(WebPage, 'ff')
+            count = get_round_trips()
+            # memoised in the identity map of the request
+            assert _namespace_prefix(WebPage, 'ff') == prefix
+            assert get_round_trips() == count
+
+            db.session.add(WebPage('abcd', 'http://lepture.com/abcd'))
+            db.session.commit()
+            assert _namespace_prefix(WebPage, 'ff') != prefix
+
+
+class TestCacheCounters(TestCase):
+    def setUp(self):
+        super(TestCacheCounters, self).setUp()
+        self.key = _counter_key(CafeTopic, 'cafe_id')
+        redis.delete(self.key)
+
+    def count(self, cafe_id):
+        return CafeTopic.cache.filter_count(cafe_id=cafe_id)
+
+    def test_insert(self):
+        assert self.count(1) == 0
+        db.session.add(CafeTopic(1, 1, 1))
+        db.session.commit()
+        assert int(redis.hget(self.key, 1)) == 1
+        assert self.count(1) == 1
+        assert redis.ttl(self.key) > 0
+
+    def test_delete(self):
+        db.session.add(CafeTopic(1, 1, 1))
+        db.session.add(CafeTopic(1, 2, 1))
+        db.session.commit()
+        assert self.count(1) == 2
+
+        db.session.delete(CafeTopic.query.get((1, 1)))
+        db.session.commit()
+        assert self.count(1) == 1
+
+    def test_move(self):
+        item = CafeTopic(1, 1, 1)
+        db.session.add(item)
+        db.session.commit()
+        assert self.count(1) == 1
+        assert self.count(2) == 0
+
+        item.cafe_id = 2
+        db.session.commit()
+        assert self.count(1) == 0
+        assert self.count(2) == 1
+
+    def test_increment_while_counting(self):
+        # a reader counts 0, then an insert is committed before it stores
+        dirty = redis.hget(self.key, '!1')
+        db.session.add(CafeTopic(1, 1, 1))
+        db.session.commit()
+        redis.eval(FILL_COUNTER_SCRIPT, 1, self.key, 1, 0, dirty or 0, 60)
+        assert redis.hget(self.key, 1) is None
+
+        assert self.count(1) == 1
+        assert redis.hget(self.key, '!1') is None
+
+    def test_recount(self):
+        db.session.add(CafeTopic(1, 1, 1))
+        db.session.add(CafeTopic(2, 1, 1))
+        db.session.add(CafeTopic(2, 2, 1))
+        db.session.commit()
+        redis.hset(self.key, 3, 5)
+
+        assert recount_cache_counter(CafeTopic, 'cafe_id', batch=1) == 2
+        assert self.count(1) == 1
+        assert self.count(2) == 2
+        assert redis.hget(self.key, 3) is None
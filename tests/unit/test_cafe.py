@@ -1 +1,45 @@
 # coding: utf-8
+
+from zerqu.models import db, CafeMember
+from zerqu.models.cafe import FOLLOWING_KEY
+from zerqu.libs.cache import redis
+from ._base import TestCase
+
+
+class TestFollowingCafes(TestCase):
+    def setUp(self):
+        super(TestFollowingCafes, self).setUp()
+        self.key = FOLLOWING_KEY % 1
+        redis.delete(self.key)
+
+    def following(self):
+        return CafeMember.get_user_following_cafe_ids(1)
+
+    def test_join_and_leave(self):
+        assert self.following() == set()
+
+        item = CafeMember(1, 1, CafeMember.ROLE_SUBSCRIBER)
+        db.session.add(item)
+        db.session.commit()
+        assert self.following() == {1}
+
+        item.role = CafeMember.ROLE_VISITOR
+        db.session.commit()
+        assert self.following() == set()
+
+        item.role = CafeMember.ROLE_MEMBER
+        db.session.commit()
+        assert self.following() == {1}
+
+        db.session.delete(item)
+        db.session.commit()
+        assert self.following() == set()
+
+    def test_reload_missing_set(self):
+        db.session.add(CafeMember(1, 1, CafeMember.ROLE_SUBSCRIBER))
+        db.session.add(CafeMember(2, 1, CafeMember.ROLE_VISITOR))
+        db.session.commit()
+        redis.delete(self.key)
+
+        assert self.following() == {1}
+        assert redis.exists(self.key)
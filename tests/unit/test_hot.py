@@ -0,0 +1,33 @@
+# coding: utf-8
+
+from zerqu.libs.cache import redis
+from zerqu.rec.hot import HOT_KEY, get_hot_topics, parse_hot_cursor
+from ._base import TestCase
+
+
+class TestHotTopics(TestCase):
+    def setUp(self):
+        super(TestHotTopics, self).setUp()
+        redis.delete(HOT_KEY)
+        redis.zadd(HOT_KEY, 5.0, 1, 5.0, 2, 5.0, 3, 4.0, 4)
+
+    def test_seek_cursor(self):
+        _, cursor = get_hot_topics(count=2)
+        assert parse_hot_cursor(cursor) == (5.0, 2)
+
+        # a new topic ranked before the cursor doesn't shift the page
+        redis.zadd(HOT_KEY, 6.0, 5)
+        _, cursor = get_hot_topics(cursor, count=2)
+        assert parse_hot_cursor(cursor) == (4.0, 4)
+
+        _, cursor = get_hot_topics(cursor, count=2)
+        assert cursor == 0
+
+    def test_first_page_cursor(self):
+        assert get_hot_topics('0', count=2) == get_hot_topics(count=2)
+        assert get_hot_topics('', count=2) == get_hot_topics(count=2)
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ValueError, get_hot_topics, 'abc')
+        self.assertRaises(ValueError, get_hot_topics, 'nan:1')
+        self.assertRaises(ValueError, get_hot_topics, 'inf:1')
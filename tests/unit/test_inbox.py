@@ -0,0 +1,102 @@
+# coding: utf-8
+
+from zerqu.models import db, CafeMember, CafeTopic
+from zerqu.libs.cache import redis
+from zerqu.rec import inbox
+from zerqu.rec.inbox import cafe_key, inbox_key, fill_list
+from zerqu.rec.inbox import push_topic, read_lists, get_fanout_cafe_ids
+from zerqu.rec.inbox import ensure_cafe_lists
+from ._base import TestCase
+
+
+class TestInbox(TestCase):
+    def setUp(self):
+        super(TestInbox, self).setUp()
+        keys = redis.keys('timeline:*') + redis.keys('following_cafes:*')
+        if keys:
+            redis.delete(*keys)
+
+        db.session.add(CafeMember(1, 1, CafeMember.ROLE_SUBSCRIBER))
+        db.session.add(CafeMember(1, 2, CafeMember.ROLE_SUBSCRIBER))
+        db.session.commit()
+
+    def test_push_topic(self):
+        fill_list(cafe_key(1), [3])
+        fill_list(inbox_key(1), [2])
+        push_topic(1, 5)
+
+        assert read_lists([cafe_key(1)]) == [5, 3]
+        assert read_lists([inbox_key(1)]) == [5, 2]
+        # missing lists are built on read
+        assert not redis.exists(inbox_key(2))
+
+    def test_push_topic_without_inboxes(self):
+        fill_list(cafe_key(1), [3])
+        fill_list(inbox_key(1), [2])
+        push_topic(1, 5, inboxes=False)
+
+        assert read_lists([cafe_key(1)]) == [5, 3]
+        assert read_lists([inbox_key(1)]) == [2]
+
+    def test_push_topic_refresh_expire(self):
+        fill_list(cafe_key(1), [3])
+        redis.expire(cafe_key(1), 60)
+        push_topic(1, 5)
+        assert redis.ttl(cafe_key(1)) > 60
+
+    def test_ensure_cafe_lists(self):
+        public = CafeTopic.STATUS_PUBLIC
+        db.session.add(CafeTopic(1, 1, 1, public))
+        db.session.add(CafeTopic(1, 3, 1, public))
+        db.session.add(CafeTopic(2, 2, 1, public))
+        db.session.add(CafeTopic(2, 4, 1))
+        db.session.commit()
+        fill_list(cafe_key(3), [9])
+
+        keys = ensure_cafe_lists([1, 2, 3, 4])
+        assert keys == [cafe_key(i) for i in [1, 2, 3, 4]]
+        assert read_lists([cafe_key(1)]) == [3, 1]
+        # drafts are not listed
+        assert read_lists([cafe_key(2)]) == [2]
+        # existing lists are kept
+        assert read_lists([cafe_key(3)]) == [9]
+        assert redis.exists(cafe_key(4))
+        assert read_lists([cafe_key(4)]) == []
+
+    def test_push_topic_capped(self):
+        fill_list(cafe_key(1), range(1, inbox.LIST_SIZE + 1))
+        push_topic(1, inbox.LIST_SIZE + 1)
+        # the placeholder is trimmed first
+        assert redis.zcard(cafe_key(1)) == inbox.LIST_SIZE
+        assert redis.zscore(cafe_key(1), 0) is None
+
+    def test_read_lists(self):
+        fill_list('timeline:a', [9, 7, 5, 3, 1])
+        fill_list('timeline:b', [8, 7, 4, 2])
+        keys = ['timeline:a', 'timeline:b', 'timeline:c']
+
+        assert read_lists(keys, count=3) == [9, 8, 7]
+        # cursor is exclusive
+        assert read_lists(keys, 7, count=3) == [5, 4, 3]
+        assert read_lists(keys, 3, count=3) == [2, 1]
+        assert read_lists(keys, 1, count=3) == []
+
+    def test_read_empty_list(self):
+        fill_list(cafe_key(1), [])
+        assert redis.exists(cafe_key(1))
+        assert read_lists([cafe_key(1)]) == []
+
+    def test_crowded_cafe(self):
+        limit = inbox.FANOUT_LIMIT
+        inbox.FANOUT_LIMIT = 1
+        try:
+            fill_list(inbox_key(1), [2])
+            fill_list(cafe_key(1), [3])
+            push_topic(1, 5)
+            assert read_lists([inbox_key(1)]) == [2]
+            assert read_lists([cafe_key(1)]) == [5, 3]
+
+            # topics of crowded cafes are read from the cafe lists
+            assert get_fanout_cafe_ids(1) == set()
+        finally:
+            inbox.FANOUT_LIMIT = limit
@@ -2,6 +2,9 @@
 import unittest
 
 from zerqu.libs import renderer
+from zerqu.libs.cache import LocalCache, CounterBuffer, cached, redis
+from zerqu.libs.cache import cache, acquire_lock, release_lock
+from zerqu.libs.cachestats import key_family, command_key
 from zerqu.libs.ratelimit import ratelimit
 from zerqu.libs.utils import is_robot, is_mobile
 from zerqu.libs.webparser import parse_meta
@@ -22,6 +25,127 @@ class TestRateLimit(TestCase):
             ratelimit('test:ratelimit', 20, 20)
 
 
+class TestLocalCache(unittest.TestCase):
+    def test_lru(self):
+        local = LocalCache(size=2, timeout=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        assert local.get('a') == 1
+        local.set('c', 3)
+        assert local.get('b') is None
+        assert local.get_dict('a', 'b', 'c') == {'a': 1, 'c': 3}
+
+    def test_timeout(self):
+        local = LocalCache(size=2, timeout=-1)
+        local.set('a', 1)
+        assert local.get('a') is None
+        assert local.count() == 0
+
+
+class TestCacheStats(unittest.TestCase):
+    def test_key_family(self):
+        assert key_family('db:get:zq_topic:12') == 'db:get:zq_topic'
+        assert key_family('db:get:zq_user|2:1') == 'db:get:zq_user'
+        assert key_family('db:ff:v12:zq_user:username$a') == 'db:ff'
+        assert key_family('feed:xml:/feed') == 'feed:xml:'
+        assert key_family(b'timeline:random_cafe_ids') == 'timeline:'
+        assert key_family('a1b2c3') == 'other'
+
+    def test_command_key(self):
+        assert command_key(('HGET', 'topic_stat:1', 'likes')) == \
+            'topic_stat:1'
+        script = 'return redis.call("get", KEYS[1])'
+        assert command_key(('EVAL', script, 1, 'timeline:cafe:1')) == \
+            'timeline:cafe:1'
+        assert command_key(('EVALSHA', 'abc', 0)) == 'script'
+        assert command_key(('PING',)) is None
+
+
+class TestCached(TestCase):
+    def test_single_load(self):
+        calls = []
+
+        @cached('test:cached:%s')
+        def load(name):
+            calls.append(name)
+            return set()
+
+        assert load('a') == set()
+        assert load('a') == set()
+        assert calls == ['a']
+
+
+class TestLock(TestCase):
+    def test_release_own_lock(self):
+        token = acquire_lock('test')
+        assert token
+        assert acquire_lock('test') is None
+
+        # expired and acquired by another process
+        cache.set('lock:test', 'other')
+        release_lock('test', token)
+        assert cache.get('lock:test') == 'other'
+        release_lock('test', 'other')
+        assert cache.get('lock:test') is None
+
+
+class TestCounterBuffer(TestCase):
+    def test_coalesce(self):
+        redis.delete('test:counter')
+        buf = CounterBuffer(self.app.extensions['zerqu_redis'], 60, 3)
+        buf.incr('test:counter', 'views')
+        buf.incr('test:counter', 'views', 2)
+        assert buf.count() == 1
+        assert redis.hget('test:counter', 'views') is None
+
+        buf.flush()
+        assert buf.count() == 0
+        assert int(redis.hget('test:counter', 'views')) == 3
+
+        # flush when size counters are pending
+        for i in range(3):
+            buf.incr('test:counter', 'f%d' % i)
+        assert buf.count() == 0
+        assert int(redis.hget('test:counter', 'f2')) == 1
+
+    def test_unique_members(self):
+        redis.delete('test:members')
+        buf = CounterBuffer(self.app.extensions['zerqu_redis'], 60, 10)
+        for member in ['a', 'b', 'a']:
+            buf.add('test:members', member, 60)
+        assert buf.count() == 2
+        buf.flush()
+        assert redis.pfcount('test:members') == 2
+
+    def test_set_members(self):
+        redis.delete('test:set')
+        buf = CounterBuffer(self.app.extensions['zerqu_redis'], 60, 10)
+        buf.add('test:set', 1, command='sadd')
+        buf.add('test:set', 1, command='sadd')
+        assert buf.count() == 1
+        buf.flush()
+        assert redis.smembers('test:set') == {b'1'}
+        assert redis.ttl('test:set') < 0
+
+    def test_failed_flush(self):
+        from redis import StrictRedis
+        redis.delete('test:counter', 'test:members')
+        # nothing listens on this port
+        buf = CounterBuffer(StrictRedis(port=1), 60, 10)
+        buf.incr('test:counter', 'views')
+        buf.add('test:members', 'a', 60)
+        buf.flush()
+        assert buf.count() == 2
+
+        buf._client = self.app.extensions['zerqu_redis']
+        buf.add('test:members', 'a', 60)
+        buf.add('test:members', 'b', 60)
+        assert buf.count() == 3
+        buf.flush()
+        assert int(redis.hget('test:counter', 'views')) == 1
+        assert redis.pfcount('test:members') == 2
+
+
 class TestUserAgent(TestCase):
     def test_is_robot(self):
         app = self.app
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+from zerqu.models import base
+from zerqu.models.topic import TopicSeries
+from zerqu.libs.cache import redis
+from ._base import TestCase
+
+# the start of a window of minute and hour buckets
+T = 3600 * 1000
+
+
+class FakeTime(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestRedisSeries(TestCase):
+    def setUp(self):
+        super(TestRedisSeries, self).setUp()
+        keys = redis.keys('topic_series:*')
+        if keys:
+            redis.delete(*keys)
+        self._time = base.time
+
+    def tearDown(self):
+        base.time = self._time
+        super(TestRedisSeries, self).tearDown()
+
+    def increase(self, now, step=1):
+        base.time = FakeTime(now)
+        TopicSeries(1).increase('views', step)
+
+    def test_get_range(self):
+        self.increase(T - 30)
+        self.increase(T - 30, 2)
+        self.increase(T + 30)
+        # buckets across the boundary are kept in different hashes
+        assert TopicSeries.locate(1, 'minute', T - 30)[0] != \
+            TopicSeries.locate(1, 'minute', T)[0]
+
+        buckets, counts = TopicSeries.get_range(
+            [1, 2], 'views', 'minute', T - 120, T + 30
+        )
+        assert buckets == [T - 120, T - 60, T]
+        assert counts == {1: [0, 3, 1], 2: [0, 0, 0]}
+
+        buckets, counts = TopicSeries.get_range(
+            [1], 'views', 'hour', T - 30, T + 30
+        )
+        assert buckets == [T - 3600, T]
+        assert counts == {1: [3, 1]}
+
+        assert TopicSeries.get_range([1], 'views', 'minute', T, T - 60) == \
+            ([], {})
+
+    def test_get_totals(self):
+        self.increase(T - 150)
+        self.increase(T - 30, 2)
+        self.increase(T + 30)
+        base.time = FakeTime(T + 30)
+        assert TopicSeries.get_totals([1, 2], 'views', 60) == {1: 3, 2: 0}
+        assert TopicSeries.get_totals([1], 'views', 180) == {1: 4}
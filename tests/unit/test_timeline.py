@@ -0,0 +1,65 @@
+# coding: utf-8
+
+from zerqu.models import db, Topic, CafeMember, CafeTopic
+from zerqu.libs.cache import redis
+from zerqu.rec.timeline import get_timeline_topics
+from ._base import TestCase
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        super(TestTimeline, self).setUp()
+        keys = redis.keys('timeline:*') + redis.keys('following_cafes:*')
+        if keys:
+            redis.delete(*keys)
+
+        for user_id in (1, 2):
+            for cafe_id in (1, 2):
+                db.session.add(CafeMember(
+                    cafe_id, user_id, CafeMember.ROLE_SUBSCRIBER
+                ))
+        self.topic_ids = []
+        for i in range(6):
+            topic = self.add_topic(i % 3 + 1)
+            self.topic_ids.append(topic.id)
+        db.session.commit()
+
+    def add_topic(self, cafe_id):
+        topic = Topic(title=u'hello', content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.flush()
+        db.session.add(CafeTopic(
+            cafe_id, topic.id, 1, CafeTopic.STATUS_PUBLIC
+        ))
+        return topic
+
+    def read_page(self, cursor, user_id):
+        topics, cursor = get_timeline_topics(cursor, user_id, count=2)
+        return [t.id for t in topics], cursor
+
+    def test_descending_pages(self):
+        # topics of cafe 1 and 2
+        expected = [
+            topic_id for i, topic_id in enumerate(self.topic_ids)
+            if i % 3 != 2
+        ]
+        expected.sort(reverse=True)
+
+        topic_ids = []
+        cursor = None
+        while True:
+            ids, cursor = self.read_page(cursor, 1)
+            # pages are disjoint, and continue in descending order
+            assert not set(ids) & set(topic_ids)
+            topic_ids.extend(ids)
+            if not cursor:
+                break
+        assert topic_ids == expected
+
+    def test_shared_page(self):
+        first, _ = self.read_page(None, 1)
+        self.add_topic(1)
+        db.session.commit()
+
+        # user 2 follows the same cafes, the cached page is shared
+        assert self.read_page(None, 2)[0] == first
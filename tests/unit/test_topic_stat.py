@@ -0,0 +1,107 @@
+# coding: utf-8
+
+from zerqu.models import db, Topic, TopicLike, TopicRead, Comment
+from zerqu.models import TopicStat
+from zerqu.libs.cache import redis
+from ._base import TestCase
+
+
+class TestTopicStat(TestCase):
+    def setUp(self):
+        super(TestTopicStat, self).setUp()
+        keys = redis.keys('topic_stat:*')
+        if keys:
+            redis.delete(*keys)
+
+        topic = Topic(title=u'hello', content=u'', user_id=1)
+        db.session.add(topic)
+        db.session.flush()
+        self.topic_id = topic.id
+        for user_id in (2, 3):
+            db.session.add(TopicLike(topic.id, user_id))
+        db.session.add(Comment(u'hello', topic.id, 2))
+        db.session.commit()
+
+    def get_stat(self, field):
+        return int(TopicStat(self.topic_id).get(field))
+
+    def test_after_delete(self):
+        assert self.get_stat('likes') == 2
+        assert self.get_stat('comments') == 1
+
+        like = TopicLike.query.get((self.topic_id, 2))
+        db.session.delete(like)
+        db.session.commit()
+        assert self.get_stat('likes') == 1
+        assert redis.sismember(TopicStat.TOPIC_DIRTY, self.topic_id)
+
+        comment = Comment.query.filter_by(topic_id=self.topic_id).first()
+        db.session.delete(comment)
+        db.session.commit()
+        assert self.get_stat('comments') == 0
+
+    def test_reconcile(self):
+        # drifted counters are fixed by the sweep
+        redis.hset(TopicStat(self.topic_id)._key, 'likes', 5)
+        TopicStat(self.topic_id).mark_dirty()
+        assert TopicStat.reconcile(batch=1) == 1
+        assert self.get_stat('likes') == 2
+        assert not redis.exists(TopicStat.TOPIC_DIRTY)
+
+    def test_reconcile_marked_meanwhile(self):
+        original = TopicStat.__dict__['recount']
+        recount = TopicStat.recount
+        marked = []
+
+        def mark_again(topic_ids):
+            # a topic marked during the recount stays dirty
+            if not marked:
+                TopicStat(self.topic_id).mark_dirty()
+                marked.append(self.topic_id)
+            recount(topic_ids)
+
+        TopicStat.recount = staticmethod(mark_again)
+        try:
+            TopicStat(self.topic_id).mark_dirty()
+            assert TopicStat.reconcile() == 2
+        finally:
+            TopicStat.recount = original
+        assert not redis.exists(TopicStat.TOPIC_DIRTY)
+
+    def test_reconcile_claimed_leftover(self):
+        # a claimed set left by a failed run is finished first
+        redis.sadd(TopicStat.TOPIC_DIRTY + ':processing', self.topic_id)
+        TopicStat(self.topic_id).mark_dirty()
+        assert TopicStat.reconcile() == 2
+        assert not redis.exists(TopicStat.TOPIC_DIRTY + ':processing')
+
+    def test_recount_range(self):
+        topic_ids = [self.topic_id]
+        for i in range(2):
+            topic = Topic(title=u'hello', content=u'', user_id=1)
+            db.session.add(topic)
+            db.session.flush()
+            topic_ids.append(topic.id)
+        first, second, empty = topic_ids
+        db.session.add(TopicLike(second, 2))
+        db.session.add(TopicRead(first, 2))
+        db.session.add(TopicRead(second, 3))
+        db.session.add(Comment(u'hello', second, 3))
+        db.session.add(Comment(u'hello', second, 2))
+        db.session.commit()
+
+        redis.delete(*[TopicStat(i)._key for i in topic_ids])
+        assert TopicStat.recount_range(first, second) == 1
+        assert TopicStat.recount_range(second, empty + 1) == 2
+
+        stats = TopicStat.get_dict(topic_ids)
+        counts = dict(
+            (i, [int(stats[i][k]) for k in ('likes', 'reads', 'comments')])
+            for i in topic_ids
+        )
+        assert counts == {
+            first: [2, 1, 1],
+            second: [1, 1, 2],
+            empty: [0, 0, 0],
+        }
+        assert TopicStat.recount_range(empty + 1, empty + 10) == 0
@@ -8,9 +8,8 @@ from sqlalchemy.exc import IntegrityError
 
 from zerqu.libs.errors import NotFound, Denied, InvalidAccount, Conflict
 from zerqu.models import db, current_user
-from zerqu.models import User, Cafe, CafeMember, CafeTopic, Topic
-from zerqu.models import iter_items_with_users
-from zerqu.models.topic import iter_topics_with_statuses
+from zerqu.models import User, Cafe, CafeMember, CafeTopic
+from zerqu.models import iter_items_with_users, hydrate_topics
 from zerqu.forms import CafeForm, TopicForm
 from .base import ApiBlueprint
 from .base import require_oauth
@@ -158,9 +157,9 @@ def list_cafe_users(slug):
 def list_cafe_topics(slug):
     cafe = Cafe.cache.first_or_404(slug=slug)
     cts, p = pagination_query(CafeTopic, 'updated_at', cafe_id=cafe.id)
-    data = Topic.cache.get_many([c.topic_id for c in cts])
-    data = list(iter_items_with_users(data))
-    data = list(iter_topics_with_statuses(data, current_user.id))
+    fields = ('users', 'stats', 'likes', 'reads', 'webpages')
+    topic_ids = [c.topic_id for c in cts]
+    data = list(hydrate_topics(topic_ids, fields, current_user.id))
     return jsonify(data=data, pagination=dict(p))
 
 
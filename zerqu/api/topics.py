@@ -3,12 +3,12 @@
 from flask import request, jsonify
 
 from zerqu.models import db, current_user, User
-from zerqu.models import CafeTopic, WebPage
-from zerqu.models import Topic, TopicLike, TopicRead, TopicStat
+from zerqu.models import CafeTopic
+from zerqu.models import Topic, TopicLike, TopicRead, TopicStat, TopicSeries
 from zerqu.models import Comment, CommentLike
-from zerqu.models import iter_items_with_users
-from zerqu.models.topic import iter_topics_with_statuses
+from zerqu.models import iter_items_with_users, hydrate_topics
 from zerqu.rec.timeline import get_timeline_topics, get_all_topics
+from zerqu.rec.hot import get_hot_topics, mark_hot_dirty
 from zerqu.forms import TopicForm, CommentForm
 from zerqu.libs.renderer import markup
 from zerqu.libs.cache import cache
@@ -24,18 +24,19 @@ api = ApiBlueprint('topics')
 @api.route('/timeline')
 @require_oauth(login=False, cache_time=600)
 def timeline():
-    cursor = int_or_raise('cursor', 0)
-    if request.args.get('show') == 'all':
-        topics, cursor = get_all_topics(cursor)
+    if request.args.get('sort') == 'hot':
+        try:
+            topics, cursor = get_hot_topics(request.args.get('cursor'))
+        except ValueError:
+            raise APIException(description='Invalid cursor parameter')
+    elif request.args.get('show') == 'all':
+        topics, cursor = get_all_topics(int_or_raise('cursor', 0))
     else:
+        cursor = int_or_raise('cursor', 0)
         topics, cursor = get_timeline_topics(cursor, current_user.id)
 
-    topics_cafes = CafeTopic.get_topics_cafes([t.id for t in topics])
-    data = []
-    for d in iter_items_with_users(topics):
-        d['cafes'] = topics_cafes.get(d['id'])
-        data.append(d)
-    data = list(iter_topics_with_statuses(data, current_user.id))
+    fields = ('users', 'cafes', 'stats', 'likes', 'reads', 'webpages')
+    data = list(hydrate_topics(topics, fields, current_user.id))
     return jsonify(data=data, cursor=cursor)
 
 
@@ -60,7 +61,11 @@ def view_topic(tid):
         data['content'] = topic.content
     else:
         data['content'] = topic.html
-        TopicStat(tid).increase('views')
+        stat = TopicStat(tid)
+        stat.increase('views', buffered=True)
+        stat.add_unique('unique_views', get_viewer_id(), buffered=True)
+        TopicSeries(tid).increase('views', buffered=True)
+        mark_hot_dirty(tid, buffered=True)
 
     data['cafes'] = CafeTopic.get_topic_cafes(tid, 1)
     data['user'] = User.cache.get(topic.user_id)
@@ -192,8 +197,6 @@ def unlike_topic(tid):
         raise Conflict(description='You already unliked it')
     with db.auto_commit():
         db.session.delete(data)
-
-    TopicStat(tid).calculate()
     return '', 204
 
 
@@ -205,8 +208,6 @@ def delete_topic_comment(tid, cid):
         raise Denied('deleting this comment')
     with db.auto_commit():
         db.session.delete(comment)
-
-    TopicStat(tid).calculate()
     return '', 204
 
 
@@ -269,13 +270,19 @@ def get_comment_or_404(tid, cid):
     return comment
 
 
+def get_viewer_id():
+    if current_user:
+        return current_user.id
+    return 'ip:%s' % request.remote_addr
+
+
 def make_topic_response(topic):
-    data = dict(topic)
-    data.update(topic.get_statuses(current_user.id))
-    if not topic.webpage:
-        return data
-    webpage = WebPage.cache.get(topic.webpage)
-    if webpage:
-        data['webpage'] = dict(webpage)
-        data['link'] = webpage.link
+    user_id = current_user.id
+    fields = ('stats', 'likes', 'reads', 'webpages')
+    data = hydrate_topics([topic], fields, user_id).to_dict(topic)
+    if user_id and 'read_by_me' not in data:
+        data['read_by_me'] = '0%'
+        read = TopicRead(topic_id=topic.id, user_id=user_id)
+        with db.auto_commit(throw=False):
+            db.session.add(read)
     return data
@@ -4,8 +4,7 @@ from flask import jsonify
 from zerqu.models import db, User, current_user
 from zerqu.models import Cafe, CafeMember, Topic
 from zerqu.models import Notification
-from zerqu.models import iter_items_with_users
-from zerqu.models.topic import iter_topics_with_statuses
+from zerqu.models import iter_items_with_users, hydrate_topics
 from zerqu.forms import RegisterForm, UserProfileForm
 from .base import ApiBlueprint
 from .base import require_oauth, require_confidential
@@ -65,14 +64,14 @@ def view_user_topics(username):
     if not topic_ids:
         return jsonify(data=[], cursor=0)
 
-    topics = Topic.cache.get_many(topic_ids)
-    data = list(iter_items_with_users(topics, {str(user.id): user}))
-    data = list(iter_topics_with_statuses(data, current_user.id))
+    fields = ('users', 'stats', 'likes', 'reads', 'webpages')
+    topics = hydrate_topics(topic_ids, fields, current_user.id)
+    data = list(topics)
 
     if len(topic_ids) < count:
         cursor = 0
     else:
-        cursor = topics[-1].id
+        cursor = topic_ids[-1]
     return jsonify(data=data, cursor=cursor)
 
 
@@ -1,11 +1,24 @@
 # coding: utf-8
 
+import json
+import base64
+import numbers
+import binascii
+import datetime
+
 from flask import request
+from werkzeug._compat import text_type
+from sqlalchemy import DateTime, Integer, String, and_, or_
+from sqlalchemy.orm import class_mapper
 
 from zerqu.libs.errors import APIException
 from zerqu.libs.utils import Pagination
 from zerqu.models import db
 
+# page numbers deeper than this must be reached by the after token
+OFFSET_PAGES = 20
+TOKEN_DATETIME = '%Y-%m-%dT%H:%M:%S.%f'
+
 
 def int_or_raise(key, value=0, maxvalue=None):
     try:
@@ -62,8 +75,31 @@ def get_pagination_query():
 
 
 def pagination_query(model, key, **filters):
+    """Paginate the model by page number for shallow pages, and by an
+    opaque ``after`` token of the last row for any page. The token seeks
+    on ``(key, primary key)``, which costs the same on every page.
+    """
     page, perpage = get_pagination_query()
 
+    if isinstance(key, str):
+        order_key = request.args.get('key', key)
+        if not hasattr(model, order_key):
+            order_key = key
+        field = getattr(model, order_key)
+        desc = request.args.get('order') != 'asc'
+    else:
+        field = key
+        desc = False
+
+    columns = [field] + [
+        c for c in class_mapper(model).primary_key
+        if c.name != field.key and c.name not in filters
+    ]
+
+    after = request.args.get('after')
+    if after:
+        page, values = decode_page_token(after, columns, desc)
+
     total = model.cache.filter_count(**filters)
     rv = Pagination(total, page, perpage)
 
@@ -75,24 +111,114 @@ def pagination_query(model, key, **filters):
             description='page should be smaller than total pages'
         )
 
-    if not isinstance(key, str):
-        q = model.query.filter_by(**filters).order_by(key)
-        return rv.fetch(q), rv
+    if hasattr(model, 'id'):
+        q = db.session.query(*columns)
+    else:
+        q = model.query
+    q = q.filter_by(**filters)
 
-    order_key = request.args.get('key', key)
-    desc = request.args.get('order') != 'asc'
-    if not hasattr(model, order_key):
-        order_key = key
+    if after:
+        q = q.filter(_seek_filter(columns, values, desc))
+    elif page > OFFSET_PAGES:
+        raise APIException(
+            description='use the after token for pages deeper than %d' %
+            OFFSET_PAGES
+        )
+    elif page > 1:
+        q = q.offset((page - 1) * perpage)
 
-    field = getattr(model, order_key)
     if desc:
-        field = field.desc()
+        q = q.order_by(*[c.desc() for c in columns])
+    else:
+        q = q.order_by(*columns)
+
+    rows = q.limit(perpage).all()
+    if rows and rv.next:
+        values = [getattr(rows[-1], c.key) for c in columns]
+        rv.after = encode_page_token(rv.next, field.key, desc, values)
+
+    # deep pages are only reachable by the after token
+    if rv.next and rv.next > OFFSET_PAGES:
+        rv.next = None
+    if rv.prev and rv.prev > OFFSET_PAGES:
+        rv.prev = None
 
     if hasattr(model, 'id'):
-        q = db.session.query(model.id).filter_by(**filters).order_by(field)
-        ids = [i for i, in rv.fetch(q)]
-        data = model.cache.get_many(ids)
+        return model.cache.get_many([o.id for o in rows]), rv
+    return rows, rv
+
+
+def encode_page_token(page, key, desc, values):
+    """Encode the next page number, the order and the values of the last
+    row into an opaque token.
+    """
+    data = [page, key, _order_name(desc)]
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            value = value.strftime(TOKEN_DATETIME)
+        data.append(value)
+    token = base64.urlsafe_b64encode(json.dumps(data).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_page_token(token, columns, desc):
+    try:
+        token = token.encode('ascii')
+        token += b'=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(token).decode('utf-8'))
+        if not isinstance(data, list):
+            raise ValueError('token must be a list')
+        page, key, order, values = int(data[0]), data[1], data[2], data[3:]
+        if len(values) != len(columns):
+            raise ValueError('mismatched columns')
+        for column, value in zip(columns, values):
+            _check_token_value(column, value)
+    except (ValueError, TypeError, IndexError, binascii.Error):
+        raise APIException(description='Invalid after token')
+
+    if key != columns[0].key or order != _order_name(desc):
+        raise APIException(
+            description='The after token belongs to another order'
+        )
+
+    try:
+        for i, column in enumerate(columns):
+            if isinstance(column.type, DateTime):
+                values[i] = datetime.datetime.strptime(
+                    values[i], TOKEN_DATETIME
+                )
+        return page, values
+    except (ValueError, TypeError):
+        raise APIException(description='Invalid after token')
+
+
+def _check_token_value(column, value):
+    """Reject a value of the wrong type before it reaches the database."""
+    if isinstance(column.type, Integer):
+        valid = isinstance(value, numbers.Integral)
+        valid = valid and not isinstance(value, bool)
+    elif isinstance(column.type, (String, DateTime)):
+        valid = isinstance(value, text_type)
     else:
-        q = model.query.filter_by(**filters).order_by(field)
-        data = rv.fetch(q)
-    return data, rv
+        valid = isinstance(value, (numbers.Number, text_type))
+    if not valid:
+        raise TypeError('invalid value of %s' % column.key)
+
+
+def _order_name(desc):
+    if desc:
+        return 'desc'
+    return 'asc'
+
+
+def _seek_filter(columns, values, desc):
+    """Rows after the values in the lexicographic order of columns."""
+    clauses = []
+    for i, column in enumerate(columns):
+        if desc:
+            seek = column < values[i]
+        else:
+            seek = column > values[i]
+        equals = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*(equals + [seek])))
+    return or_(*clauses)
@@ -1,12 +1,14 @@
 # coding: utf-8
 
-from flask import redirect, request, current_app
+from flask import redirect, request, current_app, jsonify
 from flask import url_for as flask_url_for
 from werkzeug.urls import url_encode, url_join
-from flask_admin import Admin, AdminIndexView
+from flask_admin import Admin, AdminIndexView, BaseView, expose
 from flask_admin.contrib.sqla import ModelView as _ModelView
 from zerqu.models import db, current_user
 from zerqu.models import User, Cafe, Topic
+from zerqu.libs.cache import redis
+from zerqu.libs.cachestats import load_snapshots
 
 
 class LoginMixin(object):
@@ -83,6 +85,13 @@ class TopicModelView(ModelView):
     }
 
 
+class CacheStatsView(LoginMixin, BaseView):
+    @expose('/')
+    def index(self):
+        families, tiers = load_snapshots(redis)
+        return jsonify(families=families, tiers=tiers)
+
+
 def url_for(endpoint, **values):
     if endpoint == 'admin.static':
         filename = values.pop('filename')
@@ -102,6 +111,7 @@ def init_app(app):
     admin.add_view(UserModelView(User, db.session))
     admin.add_view(CafeModelView(Cafe, db.session))
     admin.add_view(TopicModelView(Topic, db.session))
+    admin.add_view(CacheStatsView(name='Cache', endpoint='cache_stats'))
 
     if app.config.get('ADMIN_STATIC_URL'):
         app.jinja_env.globals['url_for'] = url_for
@@ -4,8 +4,8 @@ from markupsafe import escape
 from flask import Blueprint, Response
 from flask import request, current_app
 
-from zerqu.models import db, User, Cafe, Topic, CafeTopic
-from zerqu.models import WebPage
+from zerqu.models import db, Cafe, Topic, CafeTopic
+from zerqu.models import hydrate_topics
 from zerqu.libs.cache import cache, ONE_HOUR
 from zerqu.libs.utils import xmldatetime, canonical_url
 from zerqu.rec.timeline import get_all_topics
@@ -69,14 +69,17 @@ def yield_feed(title, web_url, self_url, topics):
     yield u'<id><![CDATA[%s]]></id>' % web_url
     if topics:
         yield u'<updated>%s</updated>' % xmldatetime(topics[0].updated_at)
-    users = User.cache.get_dict({o.user_id for o in topics})
-    for topic in topics:
-        for text in yield_entry(topic, users.get(str(topic.user_id))):
+    # prefetch authors and linked webpages of all entries
+    topics = hydrate_topics(topics, ('users', 'webpages'))
+    for topic in topics.topics:
+        user = topics.users.get(str(topic.user_id))
+        webpage = topic.webpage and topics.webpages.get(topic.webpage)
+        for text in yield_entry(topic, user, webpage):
             yield text
     yield u'</feed>'
 
 
-def yield_entry(topic, user):
+def yield_entry(topic, user, webpage=None):
     url = canonical_url('front.view_topic', tid=topic.id)
     yield u'<entry>'
     yield u'<id><![CDATA[%s]]></id>' % url
@@ -93,7 +96,6 @@ def yield_entry(topic, user):
     else:
         yield u'<name>Anonymous</name>'
     yield u'</author>'
-    webpage = WebPage.cache.get(topic.webpage) or u''
     if webpage:
         webpage_dict = dict(webpage)
 
@@ -109,6 +111,8 @@ def yield_entry(topic, user):
                 yield u'<div><a href="{link}">{title}</a></div>'\
                       u'<div>{link}</div>'.format(**webpage_dict)
         webpage = u''.join(yield_webpage())
+    else:
+        webpage = u''
     yield u'<content type="html"><![CDATA[%s]]></content>' % (webpage + topic.html)
 
     yield u'</entry>'
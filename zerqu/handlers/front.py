@@ -8,6 +8,7 @@ from zerqu.libs.cache import cache, ONE_HOUR
 from zerqu.libs.utils import is_robot, xmldatetime
 from zerqu.rec.timeline import get_all_topics
 from zerqu.models import db, User, Cafe, Topic, CafeTopic, Comment
+from zerqu.models import hydrate_topics
 
 
 bp = Blueprint('front', __name__, template_folder='templates')
@@ -35,13 +36,12 @@ def manifest_hook():
 @bp.route('/')
 def home():
     topics, _ = get_all_topics(0)
-    topic_users = User.cache.get_dict({o.user_id for o in topics})
-    topic_cafes = CafeTopic.get_topics_cafes([o.id for o in topics])
+    topics = hydrate_topics(topics, ('users', 'cafes'))
     return render_template(
         'front/index.html',
-        topics=topics,
-        topic_users=topic_users,
-        topic_cafes=topic_cafes,
+        topics=topics.topics,
+        topic_users=topics.users,
+        topic_cafes=topics.cafes,
     )
 
 
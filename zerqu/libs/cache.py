@@ -1,32 +1,135 @@
 # coding: utf-8
 
+import os
+import math
+import time
+import atexit
+import random
+import logging
+from threading import Lock, Thread
 from functools import wraps
+from collections import OrderedDict, Counter
 from contextlib import contextmanager
-from flask import current_app, g
+from flask import current_app, g, request, has_request_context
 from werkzeug.local import LocalProxy
 
 # defined time durations
 ONE_DAY = 86400
 ONE_HOUR = 3600
+TEN_MINUTES = 600
 FIVE_MINUTES = 300
+ONE_MINUTE = 60
+
+# single-flight lock duration and how long other processes wait for it
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 0.5
+# seconds before the invalidation listener reconnects
+RECONNECT_WAIT = 1
+
+# delete a key only if it still holds the value
+DELETE_IF_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+#: hit/miss counters of each cache tier in this process
+counters = Counter()
+
+logger = logging.getLogger('zerqu')
 
 
 def init_app(app):
     from redis import StrictRedis
     from flask_oauthlib.contrib.cache import Cache
+    from .cachestats import StatsRedis, stats
 
     # register zerqu_cache
     Cache(app, config_prefix='ZERQU')
 
+    backend = app.extensions['zerqu_cache']
+    if app.config.get('ZERQU_CACHE_STATS'):
+        app.extensions['zerqu_cache'] = InstrumentedCache(backend, stats)
+    else:
+        app.extensions['zerqu_cache'] = InstrumentedCache(backend)
+
+    if app.config.get('ZERQU_CACHE_ROUND_TRIPS_HEADER'):
+        @app.after_request
+        def add_round_trips_header(response):
+            response.headers['X-Cache-Round-Trips'] = str(get_round_trips())
+            return response
+
     # register zerqu_redis
-    client = StrictRedis.from_url(app.config['ZERQU_REDIS_URI'])
+    if app.config.get('ZERQU_CACHE_STATS'):
+        client = StatsRedis.from_url(app.config['ZERQU_REDIS_URI'])
+        interval = app.config.get('ZERQU_CACHE_STATS_INTERVAL', 60)
+
+        @app.teardown_request
+        def export_cache_stats(exc):
+            stats.export(client, interval, get_cache_stats())
+    else:
+        client = StrictRedis.from_url(app.config['ZERQU_REDIS_URI'])
     app.extensions['zerqu_redis'] = client
 
+    # register zerqu_local_cache
+    size = app.config.get('ZERQU_LOCAL_CACHE_SIZE')
+    if size:
+        timeout = app.config.get('ZERQU_LOCAL_CACHE_TIMEOUT', 60)
+        local = LocalCache(size, timeout)
+        app.extensions['zerqu_local_cache'] = local
+        channel = app.config.get('ZERQU_CACHE_CHANNEL')
+        if channel:
+            subscriber = InvalidationSubscriber(client, channel, local)
+            app.extensions['zerqu_cache_subscriber'] = subscriber
+
+    # register zerqu_counter_buffer
+    interval = app.config.get('ZERQU_COUNTER_FLUSH_INTERVAL')
+    if interval:
+        size = app.config.get('ZERQU_COUNTER_FLUSH_SIZE', 1000)
+        buf = CounterBuffer(client, interval, size)
+        app.extensions['zerqu_counter_buffer'] = buf
+
 
 def use_cache(prefix='zerqu'):
     return current_app.extensions[prefix + '_cache']
 
 
+def use_local_cache(prefix='zerqu'):
+    subscriber = current_app.extensions.get(prefix + '_cache_subscriber')
+    if subscriber:
+        subscriber.ensure()
+    return current_app.extensions.get(prefix + '_local_cache')
+
+
+def use_identity_map():
+    """A dict of cached objects living as long as the current request.
+    It is kept on the request rather than ``g``, because ``g`` lives as
+    long as the app context, which spans a whole script or worker when
+    there is no request.
+    """
+    if not has_request_context():
+        return None
+    rv = getattr(request, '_cache_identity_map', None)
+    if rv is None:
+        rv = request._cache_identity_map = {}
+    return rv
+
+
+def count_round_trip():
+    if has_request_context():
+        request._cache_round_trips = get_round_trips() + 1
+
+
+def get_round_trips():
+    """Count of shared cache calls in the current request."""
+    return getattr(request, '_cache_round_trips', 0)
+
+
+def use_counter_buffer(prefix='zerqu'):
+    return current_app.extensions.get(prefix + '_counter_buffer')
+
+
 def use_redis(prefix='zerqu'):
     key = prefix + '_redis'
     d = getattr(g, key, None)
@@ -46,11 +149,434 @@ def execute_pipeline(prefix='zerqu'):
         pipe.execute()
 
 
+class InstrumentedCache(object):
+    """Wrap a cache backend, counting the round trips of every request.
+    With stats, it records hits, misses, latency and sampled value sizes
+    per key family too.
+    """
+
+    def __init__(self, backend, stats=None):
+        self._backend = backend
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def get(self, key):
+        start = time.time()
+        rv = self._backend.get(key)
+        hit = rv is not None
+        self._record(key, start, int(hit), int(not hit))
+        return rv
+
+    def get_dict(self, *keys):
+        start = time.time()
+        rv = self._backend.get_dict(*keys)
+        self._record_lookups(keys, rv.values(), start)
+        return rv
+
+    def get_many(self, *keys):
+        start = time.time()
+        rv = self._backend.get_many(*keys)
+        self._record_lookups(keys, rv, start)
+        return rv
+
+    def set(self, key, value, timeout=None):
+        start = time.time()
+        rv = self._backend.set(key, value, timeout)
+        self._record(key, start)
+        if self._stats:
+            self._stats.record_size(key, value)
+        return rv
+
+    def set_many(self, mapping, timeout=None):
+        start = time.time()
+        rv = self._backend.set_many(mapping, timeout)
+        if mapping:
+            key = next(iter(mapping))
+            self._record(key, start)
+            if self._stats:
+                self._stats.record_size(key, mapping[key])
+        return rv
+
+    def add(self, key, value, timeout=None):
+        start = time.time()
+        rv = self._backend.add(key, value, timeout)
+        self._record(key, start)
+        return rv
+
+    def delete(self, key):
+        start = time.time()
+        rv = self._backend.delete(key)
+        self._record(key, start)
+        return rv
+
+    def delete_many(self, *keys):
+        start = time.time()
+        rv = self._backend.delete_many(*keys)
+        if keys:
+            self._record(keys[0], start)
+        return rv
+
+    def inc(self, key, delta=1):
+        start = time.time()
+        rv = self._backend.inc(key, delta)
+        self._record(key, start)
+        return rv
+
+    def write_many(self, sets=None, deletes=(), incs=None, timeout=None,
+                   adds=None):
+        """Send sets, deletes and increments together. They share one
+        pipeline when the backend is redis, other backends get a call
+        per operation. Keys of ``adds`` are set without expiry if they
+        don't exist, before the increments.
+        """
+        sets = sets or {}
+        incs = incs or {}
+        adds = adds or {}
+        keys = list(sets) + list(deletes) + list(incs) + list(adds)
+        if not keys:
+            return
+        start = time.time()
+        client = getattr(self._backend, '_client', None)
+        if client is None:
+            if sets:
+                self._backend.set_many(sets, timeout)
+            if deletes:
+                self._backend.delete_many(*deletes)
+            for key in adds:
+                self._backend.add(key, adds[key], 0)
+            for key in incs:
+                self._backend.inc(key, incs[key])
+        else:
+            prefix = self._backend.key_prefix or ''
+            dump = self._backend.dump_object
+            pipe = client.pipeline(transaction=False)
+            for key in sets:
+                pipe.setex(
+                    name=prefix + key, value=dump(sets[key]), time=timeout
+                )
+            if deletes:
+                pipe.delete(*[prefix + key for key in deletes])
+            for key in adds:
+                pipe.set(prefix + key, dump(adds[key]), nx=True)
+            for key in incs:
+                pipe.incrby(prefix + key, incs[key])
+            pipe.execute()
+        self._record(keys[0], start)
+
+    def delete_if(self, key, value):
+        """Delete the key only if it holds the value. It is atomic when the
+        backend is redis.
+        """
+        start = time.time()
+        client = getattr(self._backend, '_client', None)
+        if client is None:
+            rv = self._backend.get(key) == value
+            if rv:
+                self._backend.delete(key)
+        else:
+            prefix = self._backend.key_prefix or ''
+            value = self._backend.dump_object(value)
+            rv = bool(client.eval(DELETE_IF_SCRIPT, 1, prefix + key, value))
+        self._record(key, start)
+        return rv
+
+    def _record(self, key, start, hits=0, misses=0):
+        count_round_trip()
+        if self._stats:
+            self._stats.record(key, time.time() - start, hits, misses)
+
+    def _record_lookups(self, keys, values, start):
+        if not keys:
+            return
+        # keys of one call belong to the same family
+        hits = sum(1 for v in values if v is not None)
+        self._record(keys[0], start, hits, len(keys) - hits)
+
+
+class LocalCache(object):
+    """A per-process LRU cache with size and TTL limits. It sits in front
+    of the shared cache. Values are shared by every thread in this process,
+    models store their codec payloads in it and decode them on every hit.
+    """
+
+    def __init__(self, size=1000, timeout=60):
+        self.size = size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def count(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time.time():
+                counters['local:misses'] += 1
+                return None
+            # move it to the most recently used position
+            self._data[key] = item
+        counters['local:hits'] += 1
+        return item[1]
+
+    def get_dict(self, *keys):
+        rv = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                rv[key] = value
+        return rv
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, mapping):
+        expires_at = time.time() + self.timeout
+        with self._lock:
+            for key in mapping:
+                self._data.pop(key, None)
+                self._data[key] = (expires_at, mapping[key])
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete_many(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class InvalidationSubscriber(object):
+    """Drop stale local entries when other workers change a key. The
+    listener thread is started lazily in every process, so that forked
+    workers have their own, and it reconnects when the connection drops.
+    """
+
+    def __init__(self, client, channel, local):
+        self._client = client
+        self._channel = channel
+        self._local = local
+        self._pid = None
+        self._lock = Lock()
+
+    def ensure(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Cache invalidation listener disconnected')
+                time.sleep(RECONNECT_WAIT)
+
+    def _listen(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel)
+        # changes published while disconnected are lost
+        self._local.clear()
+        for message in pubsub.listen():
+            data = message['data']
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            self._local.delete_many(*data.split())
+
+
+def invalidate_local(*keys):
+    """Remove keys from the local cache of every worker."""
+    if not keys:
+        return
+    objects = use_identity_map()
+    if objects:
+        for key in keys:
+            objects.pop(key, None)
+    if not local_cache:
+        return
+    local_cache.delete_many(*keys)
+    channel = current_app.config.get('ZERQU_CACHE_CHANNEL')
+    if channel:
+        redis.publish(channel, ' '.join(keys))
+
+
+def get_cache_stats():
+    rv = dict(counters)
+    if local_cache:
+        rv['local:size'] = local_cache.count()
+    return rv
+
+
+class CounterBuffer(object):
+    """Coalesce HINCRBY of (key, field), and PFADD or SADD of key in this
+    process, and write them in one pipeline every ``interval`` seconds, or when
+    ``size`` counters or members are pending. Whatever a parent process
+    has pending is dropped in a forked child, the parent writes it.
+    Pending writes are flushed on exit.
+    """
+
+    def __init__(self, client, interval=5, size=1000):
+        self._client = client
+        self.interval = interval
+        self.size = size
+        self._pid = None
+        self._init_lock = Lock()
+        atexit.register(self.flush)
+
+    def _ensure_process(self):
+        # pending counters and the timer don't survive fork
+        if self._pid == os.getpid():
+            return
+        with self._init_lock:
+            if self._pid == os.getpid():
+                return
+            self._lock = Lock()
+            self._pending = Counter()
+            self._members = {}
+            self._expires = {}
+            self._added = 0
+            self._pid = os.getpid()
+            thread = Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            self.flush()
+
+    def incr(self, key, field, step=1, expire=None):
+        self._ensure_process()
+        with self._lock:
+            self._pending[(key, field)] += step
+            if expire:
+                self._expires[key] = expire
+        if self.count() >= self.size:
+            self.flush()
+
+    def add(self, key, member, expire=None, command='pfadd'):
+        """Add a member into the HyperLogLog of key, or the set of key with
+        ``command='sadd'``.
+        """
+        self._ensure_process()
+        with self._lock:
+            members, _ = self._members.setdefault(
+                (command, key), (set(), expire)
+            )
+            if member not in members:
+                members.add(member)
+                self._added += 1
+        if self.count() >= self.size:
+            self.flush()
+
+    def count(self):
+        if self._pid != os.getpid():
+            return 0
+        return len(self._pending) + self._added
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            expires, self._expires = self._expires, {}
+            members, self._members = self._members, {}
+            self._added = 0
+        if not pending and not members:
+            return
+        try:
+            with self._client.pipeline(transaction=False) as pipe:
+                for (key, field), step in pending.items():
+                    pipe.hincrby(key, field, step)
+                for key, expire in expires.items():
+                    pipe.expire(key, expire)
+                for command, key in members:
+                    values, expire = members[(command, key)]
+                    getattr(pipe, command)(key, *values)
+                    if expire:
+                        pipe.expire(key, expire)
+                pipe.execute()
+        except Exception:
+            logger.exception('Failed to flush %d counters', len(pending))
+            # keep the counters and members for the next flush, newer
+            # expires win
+            with self._lock:
+                self._pending.update(pending)
+                for key, expire in expires.items():
+                    self._expires.setdefault(key, expire)
+                for item in members:
+                    values, expire = members[item]
+                    current, _ = self._members.setdefault(
+                        item, (set(), expire)
+                    )
+                    values = values - current
+                    current.update(values)
+                    self._added += len(values)
+
+
 cache = LocalProxy(use_cache)
 redis = LocalProxy(use_redis)
+local_cache = LocalProxy(use_local_cache)
+counter_buffer = LocalProxy(use_counter_buffer)
+
+
+def acquire_lock(key, timeout=LOCK_TIMEOUT):
+    """Return a token of the lock if it is acquired, else None."""
+    token = '%016x' % random.getrandbits(64)
+    if cache.add('lock:%s' % key, token, timeout):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    """Release the lock only if it is still held by the token, it may
+    have expired and been acquired by another process.
+    """
+    cache.delete_if('lock:%s' % key, token)
+
+
+def load_once(key, getter, loader, wait=LOCK_WAIT):
+    """Single-flight loading of a missed key. Only the process holding
+    the lock calls ``loader``, others poll ``getter`` for a while before
+    giving up and loading it by themselves.
+    """
+    token = acquire_lock(key)
+    if token:
+        try:
+            return loader()
+        finally:
+            release_lock(key, token)
 
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        time.sleep(0.05)
+        rv = getter()
+        if rv is not None:
+            return rv
+    return loader()
+
+
+def should_refresh(delta, expires_at, beta=1.0):
+    """Probabilistic early expiration. The closer to ``expires_at`` and
+    the slower the computation (``delta``), the more likely to refresh.
+    """
+    return time.time() - delta * beta * math.log(random.random()) >= expires_at
 
-def cached(key_pattern, expire=ONE_HOUR):
+
+def cached(key_pattern, expire=ONE_HOUR, beta=1.0):
     def wrapper(f):
         @wraps(f)
         def decorated(*args, **kwargs):
@@ -60,11 +586,35 @@ def cached(key_pattern, expire=ONE_HOUR):
                 key = key_pattern % kwargs
             else:
                 key = key_pattern
-            rv = cache.get(key)
-            if rv:
+
+            def load():
+                start = time.time()
+                value = f(*args, **kwargs)
+                now = time.time()
+                rv = (value, now - start, now + expire)
+                cache.set(key, rv, expire)
                 return rv
-            rv = f(*args, **kwargs)
-            cache.set(key, rv, timeout=expire)
-            return rv
+
+            def get():
+                rv = cache.get(key)
+                if isinstance(rv, tuple) and len(rv) == 3:
+                    return rv
+                return None
+
+            rv = get()
+            if rv is None:
+                return load_once(key, get, load)[0]
+
+            value, delta, expires_at = rv
+            # refresh in one process, the others serve the stale value
+            if not should_refresh(delta, expires_at, beta):
+                return value
+            token = acquire_lock(key)
+            if token:
+                try:
+                    value = load()[0]
+                finally:
+                    release_lock(key, token)
+            return value
         return decorated
     return wrapper
@@ -0,0 +1,144 @@
+# coding: utf-8
+"""
+Statistics of cache and redis calls, grouped by key family. They are
+aggregated in each process and exported to redis periodically, so that
+snapshots of all workers can be merged.
+"""
+
+import os
+import time
+import socket
+from collections import defaultdict
+from flask import json
+from redis import StrictRedis
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# known key families, anything else is grouped by its first segment
+KEY_FAMILIES = (
+    'feed:xml:', 'api:', 'timeline:', 'limit:', 'lock:',
+    'topic_stat:', 'notification_list:',
+)
+EXPORT_PREFIX = 'cache_stats:'
+# measure the pickled size of one in every SIZE_SAMPLE written values
+SIZE_SAMPLE = 100
+
+# calls, hits, misses, seconds, sampled bytes, sampled values
+CALLS, HITS, MISSES, SECONDS, BYTES, SAMPLED = range(6)
+
+
+def key_family(key):
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', 'replace')
+    else:
+        key = str(key)
+
+    if key.startswith('db:'):
+        parts = key.split(':', 3)
+        if parts[1] == 'get' and len(parts) > 2:
+            return 'db:get:%s' % parts[2].split('|')[0]
+        return 'db:%s' % parts[1]
+
+    for prefix in KEY_FAMILIES:
+        if key.startswith(prefix):
+            return prefix
+    if ':' not in key:
+        return 'other'
+    return key.split(':', 1)[0] + ':'
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.data = defaultdict(lambda: [0] * 6)
+        self.exported_at = time.time()
+        self._writes = 0
+
+    def record(self, key, seconds, hits=0, misses=0):
+        item = self.data[key_family(key)]
+        item[CALLS] += 1
+        item[HITS] += hits
+        item[MISSES] += misses
+        item[SECONDS] += seconds
+
+    def record_size(self, key, value):
+        self._writes += 1
+        if self._writes % SIZE_SAMPLE:
+            return
+        item = self.data[key_family(key)]
+        item[BYTES] += len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        item[SAMPLED] += 1
+
+    def snapshot(self):
+        return {k: list(self.data[k]) for k in self.data}
+
+    def export(self, client, interval, tiers=None):
+        now = time.time()
+        if now - self.exported_at < interval:
+            return
+        self.exported_at = now
+        ident = '%s:%d' % (socket.gethostname(), os.getpid())
+        value = json.dumps({'families': self.snapshot(), 'tiers': tiers})
+        client.setex(EXPORT_PREFIX + ident, interval * 5, value)
+
+
+class StatsRedis(StrictRedis):
+    """Redis client recording the latency of every command."""
+
+    def execute_command(self, *args, **options):
+        start = time.time()
+        try:
+            return super(StatsRedis, self).execute_command(*args, **options)
+        finally:
+            key = command_key(args)
+            if key is not None:
+                stats.record(key, time.time() - start)
+
+
+def command_key(args):
+    """The key of a redis command, the first of KEYS for scripts."""
+    if len(args) < 2:
+        return None
+    if str(args[0]).upper() in ('EVAL', 'EVALSHA'):
+        if len(args) > 3 and int(args[2]):
+            return args[3]
+        return 'script'
+    return args[1]
+
+
+def summarize(data):
+    rv = {}
+    for family in data:
+        calls, hits, misses, seconds, nbytes, sampled = data[family]
+        lookups = hits + misses
+        rv[family] = {
+            'calls': calls,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / float(lookups), 4) if lookups else None,
+            'avg_ms': round(seconds * 1000 / calls, 3) if calls else None,
+            'avg_bytes': int(nbytes / sampled) if sampled else None,
+        }
+    return rv
+
+
+def load_snapshots(client):
+    """Merge the exported snapshots of all workers."""
+    families = defaultdict(lambda: [0] * 6)
+    tiers = defaultdict(int)
+    for key in client.scan_iter(match=EXPORT_PREFIX + '*'):
+        value = client.get(key)
+        if not value:
+            continue
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        value = json.loads(value)
+        for family, item in value['families'].items():
+            families[family] = [a + b for a, b in zip(families[family], item)]
+        for name, count in (value.get('tiers') or {}).items():
+            tiers[name] += count
+    return summarize(families), dict(tiers)
+
+
+stats = CacheStats()
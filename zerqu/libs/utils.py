@@ -78,6 +78,8 @@ class Pagination(object):
         self.total = total
         self.page = page
         self.perpage = perpage
+        # continuation token of the next page
+        self.after = None
 
         pages = int((total - 1) / perpage) + 1
         self.pages = pages
@@ -95,13 +97,9 @@ class Pagination(object):
         return getattr(self, item)
 
     def keys(self):
-        return ['total', 'page', 'perpage', 'prev', 'next', 'pages']
-
-    def fetch(self, q):
-        offset = (self.page - 1) * self.perpage
-        if offset:
-            q = q.offset(offset)
-        return q.limit(self.perpage).all()
+        return [
+            'total', 'page', 'perpage', 'prev', 'next', 'pages', 'after',
+        ]
 
 
 class Empty(object):
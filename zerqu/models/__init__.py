@@ -5,9 +5,10 @@ from .base import db, Base
 from .user import User, UserSession
 from .auth import oauth, OAuthClient, OAuthToken
 from .cafe import Cafe, CafeMember, CafeTopic
-from .topic import Topic, TopicLike, TopicRead, TopicStat
+from .topic import Topic, TopicLike, TopicRead, TopicStat, TopicSeries
 from .topic import Comment, CommentLike
 from .webpage import WebPage
 from .social import SocialUser
 from .notification import Notification
 from .utils import current_user, iter_items_with_users
+from .hydrate import hydrate_topics
@@ -1,29 +1,69 @@
 # coding: utf-8
 
+import time
+import random
+import datetime
+from collections import OrderedDict, Counter
 from contextlib import contextmanager
 
 from flask import current_app, abort
 from sqlalchemy import event, func
-from sqlalchemy.orm import Query, class_mapper
+from sqlalchemy.orm import Query, Session, class_mapper, object_session
 from sqlalchemy.orm.exc import UnmappedClassError
+from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.dialects.postgresql import JSON, ARRAY
 from werkzeug.utils import cached_property
 from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
 
-from zerqu.libs.utils import is_json
-from zerqu.libs.cache import cache, redis, ONE_DAY, FIVE_MINUTES
+from zerqu.libs.utils import is_json, EMPTY
+from zerqu.libs.cache import cache, redis, local_cache, counters
+from zerqu.libs.cache import counter_buffer
+from zerqu.libs.cache import invalidate_local, load_once, use_identity_map
+from zerqu.libs.cache import execute_pipeline, logger
+from zerqu.libs.cache import ONE_DAY, ONE_HOUR, ONE_MINUTE
 from zerqu.libs.errors import NotFound
+from .codecs import use_codec, CACHE_CODECS
 
 __all__ = ['db', 'CACHE_TIMES', 'Base', 'JSON', 'ARRAY']
 
 CACHE_TIMES = {
     'get': ONE_DAY,
     'count': ONE_DAY,
-    'ff': FIVE_MINUTES,
-    'fc': FIVE_MINUTES,
+    'ff': ONE_HOUR,
+    'fc': ONE_HOUR,
+    # tombstones of missing rows
+    'miss': 60,
+    # redis counters are recounted daily to fix drifts
+    'counter': ONE_DAY,
 }
 CACHE_MODEL_PREFIX = 'db'
 
+# increase a counter field only if it has been counted already, or else
+# mark it dirty, so that a count in progress won't be stored
+COUNTER_SCRIPT = '''
+if redis.call('hexists', KEYS[1], ARGV[1]) == 1 then
+    return redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+end
+redis.call('hincrby', KEYS[1], '!' .. ARGV[1], 1)
+if redis.call('ttl', KEYS[1]) < 0 then
+    redis.call('expire', KEYS[1], ARGV[3])
+end
+'''
+
+# store a count unless the field was marked dirty since it was read
+FILL_COUNTER_SCRIPT = '''
+local dirty = redis.call('hget', KEYS[1], '!' .. ARGV[1]) or '0'
+if dirty ~= ARGV[3] then
+    return 0
+end
+redis.call('hdel', KEYS[1], '!' .. ARGV[1])
+redis.call('hsetnx', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('ttl', KEYS[1]) < 0 then
+    redis.call('expire', KEYS[1], ARGV[4])
+end
+return 1
+'''
+
 
 class SQLAlchemy(_SQLAlchemy):
     @contextmanager
@@ -53,17 +93,28 @@ class CacheQuery(Query):
         else:
             suffix = str(ident)
 
-        key = mapper.class_.generate_cache_prefix('get') + suffix
-        rv = cache.get(key)
+        model = mapper.class_
+        key = model.generate_cache_prefix('get') + suffix
+        rv = _get_cached(model, key)
         if rv:
             return rv
-        rv = super(CacheQuery, self).get(ident)
-        if rv is None:
+        if rv == EMPTY:
+            return None
+
+        def load():
+            rv = super(CacheQuery, self).get(ident)
+            if rv is None:
+                _set_cached_many(model, {key: EMPTY}, CACHE_TIMES['miss'])
+            else:
+                _set_cached_many(model, {key: rv}, CACHE_TIMES['get'])
+            return rv
+
+        rv = load_once(key, lambda: _get_cached(model, key), load)
+        if rv == EMPTY:
             return None
-        cache.set(key, rv, CACHE_TIMES['get'])
         return rv
 
-    def get_dict(self, idents):
+    def get_dict(self, idents, batch=None):
         if not idents:
             return {}
 
@@ -71,26 +122,30 @@ class CacheQuery(Query):
         if len(mapper.primary_key) != 1:
             raise NotImplemented
 
-        prefix = mapper.class_.generate_cache_prefix('get')
-        keys = {prefix + str(i) for i in idents}
-        rv = cache.get_dict(*keys)
-
-        missed = {i for i in idents if rv[prefix + str(i)] is None}
-
-        rv = {k.lstrip(prefix): rv[k] for k in rv}
-
-        if not missed:
-            return rv
-
+        model = mapper.class_
+        prefix = model.generate_cache_prefix('get')
         pk = mapper.primary_key[0]
-        missing = self.filter(pk.in_(missed)).all()
-        to_cache = {}
-        for item in missing:
-            ident = str(getattr(item, pk.name))
-            to_cache[prefix + ident] = item
-            rv[ident] = item
-
-        cache.set_many(to_cache, CACHE_TIMES['get'])
+        ids = OrderedDict((str(i), i) for i in idents)
+        keys = [prefix + k for k in ids]
+
+        def load(rv, missed):
+            missing = self.filter(pk.in_(missed)).all()
+            to_cache = {}
+            for item in missing:
+                ident = str(getattr(item, pk.name))
+                to_cache[prefix + ident] = item
+                rv[ident] = item
+
+            _set_cached_many(model, to_cache, CACHE_TIMES['get'])
+            absent = {prefix + str(i): EMPTY for i in missed if not rv[str(i)]}
+            _set_cached_many(model, absent, CACHE_TIMES['miss'])
+
+        if batch is not None:
+            return batch.add(model, ids, keys, load)
+
+        rv, missed = _collect_cached(model, ids, keys)
+        if missed:
+            load(rv, missed)
         return rv
 
     def get_many(self, idents, clean=True):
@@ -101,16 +156,19 @@ class CacheQuery(Query):
 
     def filter_first(self, **kwargs):
         mapper = self._only_mapper_zero()
-        prefix = mapper.class_.generate_cache_prefix('ff')
+        model = mapper.class_
+        prefix = _namespace_prefix(model, 'ff')
         key = prefix + '-'.join(['%s$%s' % (k, kwargs[k]) for k in kwargs])
-        rv = cache.get(key)
+        rv = use_codec().loads(model, cache.get(key))
         if rv:
             return rv
+        if rv == EMPTY:
+            return None
         rv = self.filter_by(**kwargs).first()
         if rv is None:
+            cache.set(key, EMPTY, CACHE_TIMES['miss'])
             return None
-        # it is hard to invalidate this cache, expires in 2 minutes
-        cache.set(key, rv, CACHE_TIMES['ff'])
+        cache.set(key, use_codec().dumps(model, rv), CACHE_TIMES['ff'])
         return rv
 
     def filter_count(self, **kwargs):
@@ -126,7 +184,12 @@ class CacheQuery(Query):
             cache.set(key, rv, CACHE_TIMES['count'])
             return rv
 
-        prefix = model.generate_cache_prefix('fc')
+        if len(kwargs) == 1:
+            name, value = list(kwargs.items())[0]
+            if name in getattr(model, '__cache_counters__', ()):
+                return self._counter_count(model, name, value)
+
+        prefix = _namespace_prefix(model, 'fc')
         key = prefix + '-'.join(['%s$%s' % (k, kwargs[k]) for k in kwargs])
         rv = cache.get(key)
         if rv:
@@ -136,6 +199,20 @@ class CacheQuery(Query):
         cache.set(key, rv, CACHE_TIMES['fc'])
         return rv
 
+    def _counter_count(self, model, name, value):
+        key = _counter_key(model, name)
+        rv, dirty = redis.hmget(key, value, '!%s' % value)
+        if rv is not None:
+            return int(rv)
+
+        q = self.select_from(model).with_entities(func.count(1))
+        rv = q.filter_by(**{name: value}).scalar()
+        redis.eval(
+            FILL_COUNTER_SCRIPT, 1, key, value, rv, dirty or 0,
+            CACHE_TIMES['counter']
+        )
+        return rv
+
     def get_or_404(self, ident):
         data = self.get(ident)
         if data:
@@ -189,17 +266,119 @@ class BaseMixin(object):
     def __declare_last__(cls):
         @event.listens_for(cls, 'after_insert')
         def receive_after_insert(mapper, conn, target):
-            cache.inc(target.generate_cache_prefix('count'))
+            pending = CacheWriteBack.of(target)
+            pending.inc(target.generate_cache_prefix('count'))
+            pending.delete(_unique_key(target, mapper.primary_key))
+            pending.bump(target.generate_cache_prefix('ns'))
+            for name in getattr(cls, '__cache_counters__', ()):
+                pending.count(cls, name, getattr(target, name), 1)
 
         @event.listens_for(cls, 'after_update')
         def receive_after_update(mapper, conn, target):
             key = _unique_key(target, mapper.primary_key)
-            cache.set(key, target, CACHE_TIMES['get'])
+            value = use_codec().dumps(cls, target)
+            pending = CacheWriteBack.of(target)
+            pending.set(key, value)
+            pending.bump(target.generate_cache_prefix('ns'))
+            for name in getattr(cls, '__cache_counters__', ()):
+                history = get_history(target, name)
+                if history.deleted and history.added:
+                    pending.count(cls, name, history.deleted[0], -1)
+                    pending.count(cls, name, history.added[0], 1)
 
         @event.listens_for(cls, 'after_delete')
         def receive_after_delete(mapper, conn, target):
             key = _unique_key(target, mapper.primary_key)
-            cache.delete_many(key, target.generate_cache_prefix('count'))
+            pending = CacheWriteBack.of(target)
+            pending.delete(key, target.generate_cache_prefix('count'))
+            pending.bump(target.generate_cache_prefix('ns'))
+            for name in getattr(cls, '__cache_counters__', ()):
+                pending.count(cls, name, getattr(target, name), -1)
+
+
+class CacheWriteBack(object):
+    """Cache writes collected by the mapper hooks during a transaction.
+    They are sent in batch when the session commits, and dropped when it
+    rolls back.
+    """
+
+    def __init__(self):
+        self.sets = {}
+        self.deletes = set()
+        self.incs = Counter()
+        self.namespaces = set()
+        self.counters = Counter()
+
+    @classmethod
+    def of(cls, target):
+        info = object_session(target).info
+        rv = info.get('cache_write_back')
+        if rv is None:
+            rv = info['cache_write_back'] = cls()
+        return rv
+
+    def set(self, key, value):
+        self.deletes.discard(key)
+        self.sets[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.sets.pop(key, None)
+            self.incs.pop(key, None)
+            self.deletes.add(key)
+
+    def inc(self, key):
+        # a deleted counter will be recounted
+        if key not in self.deletes:
+            self.incs[key] += 1
+
+    def bump(self, key):
+        self.namespaces.add(key)
+
+    def count(self, model, name, value, delta):
+        self.counters[(_counter_key(model, name), value)] += delta
+
+    def execute(self):
+        incs = dict(self.incs)
+        # an evicted version is seeded before the bump, like a new one
+        adds = {}
+        for key in self.namespaces:
+            incs[key] = 1
+            adds[key] = _namespace_seed()
+        cache.write_many(
+            self.sets, self.deletes, incs, CACHE_TIMES['get'], adds
+        )
+        objects = use_identity_map()
+        if objects:
+            for key in self.namespaces:
+                objects.pop(key, None)
+        # counters and invalidations share one pipeline of zerqu_redis
+        with execute_pipeline():
+            for key, value in self.counters:
+                delta = self.counters[(key, value)]
+                if delta:
+                    redis.eval(
+                        COUNTER_SCRIPT, 1, key, value, delta,
+                        CACHE_TIMES['counter']
+                    )
+            invalidate_local(*(list(self.sets) + list(self.deletes)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _receive_after_commit(session):
+    pending = session.info.pop('cache_write_back', None)
+    if not pending:
+        return
+    try:
+        pending.execute()
+    except Exception:
+        # the data is committed already, stale entries expire in time
+        logger.exception('Failed to write back cache')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _receive_after_rollback(session):
+    session.info.pop('cache_write_back', None)
 
 
 class Base(db.Model, BaseMixin):
@@ -216,6 +395,242 @@ def _unique_key(target, primary_key):
     return target.generate_cache_prefix('get') + key
 
 
+def _counter_key(model, name):
+    return model.generate_cache_prefix('counter') + name
+
+
+def iter_cache_counters():
+    """Yield (model, column name) of every counter hash."""
+    for model in list(db.Model._decl_class_registry.values()):
+        for name in getattr(model, '__cache_counters__', ()):
+            yield model, name
+
+
+def recount_cache_counter(model, name, batch=1000):
+    """Rebuild a counter hash with one GROUP BY query. Fields are written
+    into a new hash in batches, which replaces the old one at last.
+
+    :return: count of fields.
+    """
+    key = _counter_key(model, name)
+    tmp = key + ':recount'
+    column = getattr(model, name)
+    q = db.session.query(column, func.count(1)).group_by(column)
+
+    redis.delete(tmp)
+    total = 0
+    mapping = {}
+    for value, rv in q.yield_per(batch):
+        mapping[value] = rv
+        if len(mapping) == batch:
+            redis.hmset(tmp, mapping)
+            total += len(mapping)
+            mapping = {}
+
+    with redis.pipeline() as pipe:
+        if mapping:
+            pipe.hmset(tmp, mapping)
+            total += len(mapping)
+        if total:
+            pipe.expire(tmp, CACHE_TIMES['counter'])
+            pipe.rename(tmp, key)
+        else:
+            pipe.delete(key)
+        pipe.execute()
+    return total
+
+
+def _namespace_seed():
+    # start from a timestamp, so that an evicted version won't collide
+    # with an old one
+    return int(time.time() * 1000)
+
+
+def _namespace_prefix(model, name):
+    """Prefix of filter_first and filter_count keys. It contains the
+    namespace version of the model, which is bumped by every write to the
+    table, so that all these keys are invalidated at once.
+
+    There is one version per table rather than per filtered column. A
+    write to any column invalidates every filter of the table, which costs
+    a few extra misses but needs only one bump per write.
+    """
+    key = model.generate_cache_prefix('ns')
+    objects = use_identity_map()
+    version = objects.get(key) if objects is not None else None
+    if version is None:
+        version = cache.get(key)
+    if version is None:
+        cache.add(key, _namespace_seed(), 0)
+        version = cache.get(key)
+    if objects is not None:
+        objects[key] = version
+    return '%sv%s:' % (model.generate_cache_prefix(name), version)
+
+
+def _unwrap_missing(value):
+    if value == EMPTY:
+        return None
+    return value
+
+
+def _local_dumps(model, obj):
+    # the local tier holds column values instead of instances shared by
+    # threads, whatever the codec of the shared cache is
+    return CACHE_CODECS['tuple'].dumps(model, obj)
+
+
+def _local_loads(model, value):
+    return CACHE_CODECS['tuple'].loads(model, value, copy_values=True)
+
+
+def _get_cached(model, key):
+    objects = use_identity_map()
+    if objects and key in objects:
+        counters['request:hits'] += 1
+        return objects[key]
+
+    rv = None
+    if local_cache:
+        rv = _local_loads(model, local_cache.get(key))
+
+    if rv is None:
+        rv = use_codec().loads(model, cache.get(key))
+        if rv is None:
+            counters['shared:misses'] += 1
+            return None
+        counters['shared:hits'] += 1
+        if local_cache:
+            local_cache.set(key, _local_dumps(model, rv))
+
+    if objects is not None:
+        objects[key] = rv
+    return rv
+
+
+def _get_cached_dict(model, keys):
+    return _get_cached_multi([(model, keys)])
+
+
+def _get_cached_multi(lookups):
+    """Get cached values of ``(model, keys)`` lookups, all the keys missed
+    in the request and local tiers are fetched in one round trip.
+    """
+    models = OrderedDict()
+    for model, keys in lookups:
+        for k in keys:
+            models[k] = model
+    keys = list(models)
+
+    objects = use_identity_map()
+    rv = {}
+    if objects:
+        rv = {k: objects[k] for k in keys if k in objects}
+        counters['request:hits'] += len(rv)
+        keys = [k for k in keys if k not in rv]
+
+    found = {}
+    if local_cache and keys:
+        payloads = local_cache.get_dict(*keys)
+        for k in payloads:
+            value = _local_loads(models[k], payloads[k])
+            if value is not None:
+                found[k] = value
+        keys = [k for k in keys if k not in found]
+
+    if keys:
+        codec = use_codec()
+        shared = cache.get_dict(*keys)
+        loaded = {}
+        for k in shared:
+            value = codec.loads(models[k], shared[k])
+            if value is not None:
+                loaded[k] = value
+        counters['shared:hits'] += len(loaded)
+        counters['shared:misses'] += len(keys) - len(loaded)
+        if local_cache and loaded:
+            local_cache.set_many({
+                k: _local_dumps(models[k], loaded[k]) for k in loaded
+            })
+        found.update(loaded)
+
+    if objects is not None:
+        objects.update(found)
+    rv.update(found)
+    return rv
+
+
+def _collect_cached(model, ids, keys):
+    """Map ``ids`` (str to raw ident) to the cached values of ``keys`` in
+    the same order. Returns the mapping and the raw idents not cached.
+    """
+    return _fill_cached(_get_cached_dict(model, keys), ids, keys)
+
+
+def _fill_cached(cached, ids, keys):
+    rv = OrderedDict()
+    missed = []
+    for k, key in zip(ids, keys):
+        value = cached.get(key)
+        if value is None:
+            missed.append(ids[k])
+        rv[k] = _unwrap_missing(value)
+    return rv, missed
+
+
+class CacheBatch(object):
+    """Collect lookups of several models, and get them from the shared
+    cache in one round trip::
+
+        batch = CacheBatch()
+        users = User.cache.get_dict(user_ids, batch=batch)
+        cafes = Cafe.cache.get_dict(cafe_ids, batch=batch)
+        batch.execute()
+
+    The returned dicts are filled when the batch is executed, items not
+    cached are loaded from the database then.
+    """
+
+    def __init__(self):
+        self._lookups = []
+
+    def add(self, model, ids, keys, load):
+        """Add a lookup of ``keys`` for ``ids`` (str to raw ident), the
+        missed idents are passed to ``load(rv, missed)``.
+        """
+        rv = OrderedDict()
+        self._lookups.append((model, ids, keys, load, rv))
+        return rv
+
+    def execute(self):
+        lookups, self._lookups = self._lookups, []
+        if not lookups:
+            return
+        cached = _get_cached_multi([(o[0], o[2]) for o in lookups])
+        for model, ids, keys, load, rv in lookups:
+            found, missed = _fill_cached(cached, ids, keys)
+            rv.update(found)
+            if missed:
+                load(rv, missed)
+
+
+def _set_cached_many(model, mapping, timeout):
+    if not mapping:
+        return
+    # jitter the timeout, so that popular keys won't expire at the same time
+    timeout += random.randint(0, timeout // 10)
+    codec = use_codec()
+    data = {k: codec.dumps(model, mapping[k]) for k in mapping}
+    cache.set_many(data, timeout)
+    if local_cache:
+        local_cache.set_many({
+            k: _local_dumps(model, mapping[k]) for k in mapping
+        })
+    objects = use_identity_map()
+    if objects is not None:
+        objects.update(mapping)
+
+
 def _itervalues(data, idents):
     for k in idents:
         item = data[str(k)]
@@ -223,15 +638,61 @@ def _itervalues(data, idents):
             yield item
 
 
+# decrease a counter field, but never below zero
+DECREASE_SCRIPT = '''
+local rv = redis.call('hincrby', KEYS[1], ARGV[1], -tonumber(ARGV[2]))
+if rv < 0 then
+    redis.call('hset', KEYS[1], ARGV[1], 0)
+    return 0
+end
+return rv
+'''
+
+
 class RedisStat(object):
     KEY_PREFIX = 'stat:{}'
+    # fields counted by a HyperLogLog of every day
+    UNIQUE_FIELDS = ()
+    # unique fields count the members of the latest days
+    UNIQUE_DAYS = 7
 
     def __init__(self, ident):
         self.ident = ident
         self._key = self.KEY_PREFIX.format(ident)
 
-    def increase(self, field, step=1):
-        redis.hincrby(self._key, field, step)
+    @classmethod
+    def unique_keys(cls, ident, field):
+        """Keys of the field from today back to UNIQUE_DAYS ago."""
+        prefix = '%s:%s:' % (cls.KEY_PREFIX.format(ident), field)
+        today = datetime.datetime.utcnow().date()
+        return [
+            prefix + (today - datetime.timedelta(days=i)).strftime('%Y%m%d')
+            for i in range(cls.UNIQUE_DAYS)
+        ]
+
+    def add_unique(self, field, member, buffered=False):
+        """Add a member into the unique field, e.g. the viewer of views."""
+        key = self.unique_keys(self.ident, field)[0]
+        expire = ONE_DAY * (self.UNIQUE_DAYS + 1)
+        if buffered and counter_buffer:
+            counter_buffer.add(key, member, expire)
+        else:
+            with redis.pipeline() as pipe:
+                pipe.pfadd(key, member)
+                pipe.expire(key, expire)
+                pipe.execute()
+
+    def increase(self, field, step=1, buffered=False):
+        """Increase the field, buffered increments are written in batch
+        a few seconds later.
+        """
+        if buffered and counter_buffer:
+            counter_buffer.incr(self._key, field, step)
+        else:
+            redis.hincrby(self._key, field, step)
+
+    def decrease(self, field, step=1):
+        redis.eval(DECREASE_SCRIPT, 1, self._key, field, step)
 
     def get(self, key, default=0):
         return self.value.get(key, default)
@@ -244,16 +705,114 @@ class RedisStat(object):
 
     @cached_property
     def value(self):
-        return redis.hgetall(self._key)
+        return self.get_many([self.ident])[0]
 
     @classmethod
     def get_many(cls, ids):
         with redis.pipeline() as pipe:
             for i in ids:
                 pipe.hgetall(cls.KEY_PREFIX.format(i))
-            return pipe.execute()
+                for field in cls.UNIQUE_FIELDS:
+                    pipe.pfcount(*cls.unique_keys(i, field))
+            rv = pipe.execute()
+
+        size = len(cls.UNIQUE_FIELDS) + 1
+        stats = []
+        for i in range(0, len(rv), size):
+            stat = rv[i]
+            stat.update(zip(cls.UNIQUE_FIELDS, rv[i + 1:i + size]))
+            stats.append(stat)
+        return stats
 
     @classmethod
     def get_dict(cls, ids):
         rv = cls.get_many(ids)
         return dict(zip(ids, rv))
+
+
+class RedisSeries(object):
+    """Counters of time buckets, next to the lifetime counters of a
+    RedisStat. Buckets of a resolution are grouped into one hash for a
+    window of time, with fields of ``{field}:{bucket}``. The hash expires
+    once its buckets are older than the retention.
+    """
+    KEY_PREFIX = 'series:{}'
+    # resolution: (bucket, window, retention) in seconds
+    RESOLUTIONS = {
+        'minute': (ONE_MINUTE, ONE_HOUR, ONE_HOUR * 3),
+        'hour': (ONE_HOUR, ONE_DAY, ONE_DAY * 8),
+        'day': (ONE_DAY, ONE_DAY * 30, ONE_DAY * 90),
+    }
+
+    def __init__(self, ident):
+        self.ident = ident
+
+    @classmethod
+    def locate(cls, ident, resolution, timestamp):
+        """Key and field prefix of the bucket at timestamp."""
+        size, window, _ = cls.RESOLUTIONS[resolution]
+        bucket = int(timestamp) // size * size
+        key = '%s:%s:%d' % (
+            cls.KEY_PREFIX.format(ident), resolution, bucket // window
+        )
+        return key, bucket
+
+    def increase(self, field, step=1, buffered=False):
+        """Increase the field in current buckets of every resolution. Use
+        it in ``execute_pipeline`` to write them in one round trip.
+        """
+        now = time.time()
+        for resolution in self.RESOLUTIONS:
+            _, window, retention = self.RESOLUTIONS[resolution]
+            key, bucket = self.locate(self.ident, resolution, now)
+            name = '%s:%d' % (field, bucket)
+            expire = window + retention
+            if buffered and counter_buffer:
+                counter_buffer.incr(key, name, step, expire)
+            else:
+                redis.hincrby(key, name, step)
+                redis.expire(key, expire)
+
+    @classmethod
+    def get_range(cls, ids, field, resolution, start, end=None):
+        """Counts of the field in buckets from start to end (timestamps)
+        of every ident, in one pipeline::
+
+            # views of every minute in the last hour
+            TopicSeries.get_range(ids, 'views', 'minute', time.time() - 3600)
+
+        :return: a list of bucket timestamps, and a dict of ident to counts.
+        """
+        if end is None:
+            end = time.time()
+        size, window, _ = cls.RESOLUTIONS[resolution]
+        buckets = list(range(int(start) // size * size, int(end) + 1, size))
+        if not buckets:
+            return [], {}
+
+        # buckets in the same hash are read by one HMGET
+        groups = OrderedDict()
+        for bucket in buckets:
+            groups.setdefault(bucket // window, []).append(bucket)
+
+        with redis.pipeline() as pipe:
+            for ident in ids:
+                for group in groups.values():
+                    key, _ = cls.locate(ident, resolution, group[0])
+                    pipe.hmget(key, ['%s:%d' % (field, b) for b in group])
+            rv = pipe.execute()
+
+        counts = {}
+        for i, ident in enumerate(ids):
+            values = []
+            for chunk in rv[i * len(groups):(i + 1) * len(groups)]:
+                values.extend(int(v or 0) for v in chunk)
+            counts[ident] = values
+        return buckets, counts
+
+    @classmethod
+    def get_totals(cls, ids, field, seconds, resolution='minute'):
+        """Sum of the field in the last seconds of every ident."""
+        start = time.time() - seconds
+        _, counts = cls.get_range(ids, field, resolution, start)
+        return {ident: sum(counts[ident]) for ident in counts}
@@ -2,12 +2,17 @@
 import re
 import time
 from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
 from zerqu.libs.utils import run_task
-from zerqu.libs.cache import execute_pipeline
-from .topic import Topic, TopicStat, TopicLike, TopicRead
+from zerqu.libs.cache import cache, execute_pipeline
+from zerqu.rec.inbox import push_topic, drop_inbox, get_engine, ENGINES
+from zerqu.rec.hot import update_hot_score, mark_hot_dirty
+from zerqu.rec.sampler import update_sample_cafe, increase_activity
+from .topic import Topic, TopicStat, TopicSeries, TopicLike, TopicRead
 from .topic import Comment, CommentLike
 from .notification import Notification
 from .user import User
+from .cafe import Cafe, CafeMember, CafeTopic
 
 
 def bind_events():
@@ -20,6 +25,14 @@ def bind_events():
     def record_like_topic(mapper, conn, target):
         run_task(_record_like_topic, target)
 
+    @event.listens_for(TopicLike, 'after_delete')
+    def record_unlike_topic(mapper, conn, target):
+        run_task(_record_unlike_topic, target)
+
+    @event.listens_for(Comment, 'after_delete')
+    def record_delete_comment(mapper, conn, target):
+        run_task(_record_delete_comment, target)
+
     @event.listens_for(TopicRead, 'after_insert')
     def record_read_topic(mapper, conn, target):
         run_task(_record_read_topic, target)
@@ -28,6 +41,40 @@ def bind_events():
     def record_like_comment(mapper, conn, target):
         run_task(_record_like_comment, target)
 
+    @event.listens_for(CafeTopic, 'after_insert')
+    def record_add_cafe_topic(mapper, conn, target):
+        if target.status == CafeTopic.STATUS_PUBLIC:
+            run_task(_record_publish_cafe_topic, target)
+
+    @event.listens_for(CafeTopic, 'after_update')
+    def record_update_cafe_topic(mapper, conn, target):
+        history = get_history(target, 'status')
+        if history.added and target.status == CafeTopic.STATUS_PUBLIC:
+            run_task(_record_publish_cafe_topic, target)
+
+    @event.listens_for(Cafe, 'after_insert')
+    def record_add_cafe(mapper, conn, target):
+        run_task(_record_add_cafe, target)
+
+    @event.listens_for(Cafe, 'after_update')
+    def record_update_cafe(mapper, conn, target):
+        if get_history(target, 'permission').added:
+            run_task(update_sample_cafe, target)
+
+    @event.listens_for(CafeMember, 'after_insert')
+    def record_add_cafe_member(mapper, conn, target):
+        if target.role and target.role >= CafeMember.ROLE_SUBSCRIBER:
+            run_task(_record_change_membership, target)
+
+    @event.listens_for(CafeMember, 'after_update')
+    def record_update_cafe_member(mapper, conn, target):
+        if get_history(target, 'role').added:
+            run_task(_record_change_membership, target)
+
+    @event.listens_for(CafeMember, 'after_delete')
+    def record_delete_cafe_member(mapper, conn, target):
+        run_task(_record_change_membership, target, deleted=True)
+
 
 def _record_add_comment(comment):
     topic = Topic.cache.get(comment.topic_id)
@@ -39,6 +86,7 @@ def _record_add_comment(comment):
         stat = TopicStat(topic.id)
         stat.increase('comments')
         stat['timestamp'] = time.time()
+        TopicSeries(topic.id).increase('comments')
 
         if topic.user_id != comment.user_id:
             Notification(topic.user_id).add(
@@ -51,7 +99,7 @@ def _record_add_comment(comment):
         names = re.findall(r'(?:^|\s)@([0-9a-z]+)', comment.content)
         for username in set(names):
             user = User.cache.filter_first(username=username)
-            if user.id in (comment.user_id, topic.user_id):
+            if not user or user.id in (comment.user_id, topic.user_id):
                 continue
 
             Notification(user.id).add(
@@ -61,12 +109,42 @@ def _record_add_comment(comment):
                 comment_id=comment.id,
             )
 
+    update_hot_score(topic)
+
+
+def _record_add_cafe(cafe):
+    update_sample_cafe(cafe)
+    cache.delete('timeline:owned_cafe_ids:%s' % cafe.user_id)
+
+
+def _record_publish_cafe_topic(ct):
+    engine = get_engine()
+    if engine in ENGINES:
+        push_topic(ct.cafe_id, ct.topic_id, inboxes=engine == 'fanout')
+    increase_activity(ct.cafe_id)
+    topic = Topic.cache.get(ct.topic_id)
+    if topic:
+        update_hot_score(topic)
+
+
+def _record_change_membership(member, deleted=False):
+    role = member.role or CafeMember.ROLE_VISITOR
+    if not deleted and role >= CafeMember.ROLE_SUBSCRIBER:
+        CafeMember.follow_cafe(member.user_id, member.cafe_id)
+    else:
+        CafeMember.unfollow_cafe(member.user_id, member.cafe_id)
+    if get_engine() == 'fanout':
+        drop_inbox(member.user_id)
+
 
 def _record_like_topic(like):
     topic = Topic.cache.get(like.topic_id)
     if not topic:
         return
-    TopicStat(topic.id).increase('likes')
+    with execute_pipeline():
+        TopicStat(topic.id).increase('likes')
+        TopicSeries(topic.id).increase('likes')
+    update_hot_score(topic)
 
     if topic.user_id != like.user_id:
         Notification(topic.user_id).add(
@@ -76,8 +154,31 @@ def _record_like_topic(like):
         )
 
 
+def _record_unlike_topic(like):
+    with execute_pipeline():
+        stat = TopicStat(like.topic_id)
+        stat.decrease('likes')
+        stat.mark_dirty()
+    topic = Topic.cache.get(like.topic_id)
+    if topic:
+        update_hot_score(topic)
+
+
+def _record_delete_comment(comment):
+    with execute_pipeline():
+        stat = TopicStat(comment.topic_id)
+        stat.decrease('comments')
+        stat.mark_dirty()
+    topic = Topic.cache.get(comment.topic_id)
+    if topic:
+        update_hot_score(topic)
+
+
 def _record_read_topic(read):
-    TopicStat(read.topic_id).increase('reads')
+    with execute_pipeline():
+        TopicStat(read.topic_id).increase('reads')
+        TopicSeries(read.topic_id).increase('reads')
+    mark_hot_dirty(read.topic_id)
 
 
 def _record_like_comment(like):
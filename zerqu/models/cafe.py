@@ -1,16 +1,26 @@
 # coding: utf-8
 
 import datetime
-from collections import defaultdict
 from werkzeug.utils import cached_property
 from sqlalchemy import Column
 from sqlalchemy import String, Unicode, DateTime
 from sqlalchemy import SmallInteger, Integer
 from zerqu.libs.utils import EMPTY
+from zerqu.libs.cache import redis, ONE_DAY
 from .base import db, Base, JSON
 
 __all__ = ['Cafe', 'CafeMember', 'CafeTopic']
 
+FOLLOWING_KEY = 'following_cafes:%s'
+FOLLOWING_EXPIRE = ONE_DAY * 7
+
+# only update the set when it is loaded, a missing set is loaded on read
+FOLLOW_SCRIPT = '''
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call(ARGV[1], KEYS[1], ARGV[2])
+end
+'''
+
 
 class Cafe(Base):
     __tablename__ = 'zq_cafe'
@@ -139,6 +149,7 @@ class Cafe(Base):
 
 class CafeMember(Base):
     __tablename__ = 'zq_cafe_member'
+    __cache_counters__ = ('cafe_id',)
 
     # not joined, but has topics or comments in this cafe
     ROLE_VISITOR = 0
@@ -193,10 +204,30 @@ class CafeMember(Base):
 
     @classmethod
     def get_user_following_cafe_ids(cls, user_id):
-        # TODO: cache
+        key = FOLLOWING_KEY % user_id
+        rv = redis.smembers(key)
+        if rv:
+            # the placeholder 0 marks a loaded set
+            return {int(i) for i in rv if int(i)}
+
         q = db.session.query(cls.cafe_id).filter_by(user_id=user_id)
         q = q.filter(cls.role >= cls.ROLE_SUBSCRIBER)
-        return {cafe_id for cafe_id, in q}
+        cafe_ids = {cafe_id for cafe_id, in q}
+        with redis.pipeline() as pipe:
+            pipe.sadd(key, 0, *cafe_ids)
+            pipe.expire(key, FOLLOWING_EXPIRE)
+            pipe.execute()
+        return cafe_ids
+
+    @classmethod
+    def follow_cafe(cls, user_id, cafe_id):
+        key = FOLLOWING_KEY % user_id
+        redis.eval(FOLLOW_SCRIPT, 1, key, 'sadd', cafe_id)
+
+    @classmethod
+    def unfollow_cafe(cls, user_id, cafe_id):
+        key = FOLLOWING_KEY % user_id
+        redis.eval(FOLLOW_SCRIPT, 1, key, 'srem', cafe_id)
 
     @classmethod
     def get_cafe_admin_ids(cls, cafe_id):
@@ -207,6 +238,7 @@ class CafeMember(Base):
 
 class CafeTopic(Base):
     __tablename__ = 'zq_cafe_topic'
+    __cache_counters__ = ('cafe_id',)
 
     STATUS_DRAFT = 0
     STATUS_PUBLIC = 1
@@ -240,15 +272,10 @@ class CafeTopic(Base):
         return Cafe.cache.get_many([i for i, in q])
 
     @classmethod
-    def get_topics_cafes(cls, topic_ids):
+    def get_topics_cafe_ids(cls, topic_ids):
+        """Pairs of (topic_id, cafe_id) of public topics."""
+        if not topic_ids:
+            return []
         q = db.session.query(cls.topic_id, cls.cafe_id)
         q = q.filter_by(status=cls.STATUS_PUBLIC)
-        q = q.filter(cls.topic_id.in_(topic_ids)).all()
-        cafe_ids = {i for _, i in q}
-        cafes = Cafe.cache.get_dict(cafe_ids)
-        topic_cafes = defaultdict(list)
-        for tid, cid in q:
-            cafe = cafes.get(str(cid))
-            if cafe:
-                topic_cafes[tid].append(cafe)
-        return topic_cafes
+        return q.filter(cls.topic_id.in_(topic_ids)).all()
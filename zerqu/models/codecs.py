@@ -0,0 +1,79 @@
+# coding: utf-8
+"""
+Codecs for model instances stored in the shared cache. The cache backend
+pickles whatever it gets, a codec decides what to hand over to it.
+"""
+
+import copy
+import zlib
+from flask import current_app
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
+
+__all__ = ['CACHE_CODECS', 'PickleCodec', 'TupleCodec', 'use_codec']
+
+_signatures = {}
+
+
+class PickleCodec(object):
+    """Store the whole model instance, including its instance state."""
+
+    def dumps(self, model, obj):
+        return obj
+
+    def loads(self, model, value, copy_values=False):
+        return value
+
+
+class TupleCodec(object):
+    """Store only the column values of a model instance, together with a
+    signature of the column names. A detached instance is rebuilt on read,
+    a value of an outdated column layout is treated as a miss.
+    """
+
+    def dumps(self, model, obj):
+        if not isinstance(obj, model):
+            return obj
+        keys, signature = column_signature(model)
+        return signature, tuple(getattr(obj, k) for k in keys)
+
+    def loads(self, model, value, copy_values=False):
+        """Rebuild an instance, with ``copy_values`` mutable values such
+        as JSON columns are copied, for a value shared by threads.
+        """
+        if not isinstance(value, tuple):
+            # tombstones, or instances cached by PickleCodec
+            return value
+
+        keys, signature = column_signature(model)
+        if value[0] != signature:
+            return None
+
+        mapper = class_mapper(model)
+        obj = mapper.class_manager.new_instance()
+        for key, v in zip(keys, value[1]):
+            if copy_values and isinstance(v, (dict, list)):
+                v = copy.deepcopy(v)
+            set_committed_value(obj, key, v)
+        instance_state(obj).key = mapper.identity_key_from_instance(obj)
+        return obj
+
+
+def column_signature(model):
+    rv = _signatures.get(model)
+    if rv is None:
+        keys = tuple(prop.key for prop in class_mapper(model).column_attrs)
+        signature = zlib.crc32(','.join(keys).encode('utf-8')) & 0xffffffff
+        rv = _signatures[model] = (keys, signature)
+    return rv
+
+
+CACHE_CODECS = {
+    'pickle': PickleCodec(),
+    'tuple': TupleCodec(),
+}
+
+
+def use_codec():
+    name = current_app.config.get('ZERQU_CACHE_CODEC', 'tuple')
+    return CACHE_CODECS[name]
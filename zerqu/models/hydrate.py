@@ -0,0 +1,129 @@
+# coding: utf-8
+"""
+Load topics together with their related items in batch. The cache
+lookups of users, cafes, likes, reads and webpages share one round trip,
+and the stats are read in one redis pipeline.
+"""
+
+from collections import defaultdict
+from .base import CacheBatch
+from .user import User
+from .cafe import Cafe, CafeTopic
+from .topic import Topic, TopicStat, TopicLike, TopicRead
+from .webpage import WebPage
+
+FIELDS = ('users', 'cafes', 'stats', 'likes', 'reads', 'webpages')
+
+
+class HydratedTopics(object):
+    """Topics with the related items of ``fields``. Related items are
+    available as dicts for templates, iterate it for topic dicts.
+
+    :param topics: a list of topics or topic ids.
+    :param fields: related items to load.
+    :param user_id: likes and reads are of this user.
+    """
+
+    def __init__(self, topics, fields=FIELDS, user_id=None):
+        if topics and not isinstance(topics[0], Topic):
+            topics = Topic.cache.get_many(topics)
+        self.topics = topics
+        self.fields = set(fields)
+        self.user_id = user_id
+
+        # keyed by str idents
+        self.users = {}
+        self.webpages = {}
+        self.liked = {}
+        self.reads = {}
+        # keyed by topic id
+        self.cafes = defaultdict(list)
+        self.stats = {}
+
+        if topics:
+            self._load()
+
+    def _load(self):
+        topic_ids = [t.id for t in self.topics]
+        fields = self.fields
+        batch = CacheBatch()
+
+        if 'users' in fields:
+            user_ids = {t.user_id for t in self.topics}
+            self.users = User.cache.get_dict(user_ids, batch=batch)
+
+        if 'webpages' in fields:
+            uuids = {t.webpage for t in self.topics if t.webpage}
+            self.webpages = WebPage.cache.get_dict(uuids, batch=batch)
+
+        if 'cafes' in fields:
+            pairs = CafeTopic.get_topics_cafe_ids(topic_ids)
+            cafe_ids = {cafe_id for _, cafe_id in pairs}
+            cafes = Cafe.cache.get_dict(cafe_ids, batch=batch)
+
+        if self.user_id and 'likes' in fields:
+            self.liked = TopicLike.topics_liked_by_user(
+                self.user_id, topic_ids, batch=batch
+            )
+
+        if self.user_id and 'reads' in fields:
+            self.reads = TopicRead.topics_read_by_user(
+                self.user_id, topic_ids, batch=batch
+            )
+
+        batch.execute()
+
+        if 'cafes' in fields:
+            for topic_id, cafe_id in pairs:
+                cafe = cafes.get(str(cafe_id))
+                if cafe:
+                    self.cafes[topic_id].append(cafe)
+
+        if 'stats' in fields:
+            self.stats = TopicStat.get_dict(topic_ids)
+
+    def __len__(self):
+        return len(self.topics)
+
+    def __iter__(self):
+        for topic in self.topics:
+            yield self.to_dict(topic)
+
+    def to_dict(self, topic):
+        data = dict(topic)
+        fields = self.fields
+        ident = str(topic.id)
+
+        if 'users' in fields:
+            user = self.users.get(str(topic.user_id))
+            if user:
+                data['user'] = dict(user)
+
+        if 'cafes' in fields:
+            data['cafes'] = self.cafes.get(topic.id)
+
+        if 'stats' in fields:
+            stat = self.stats.get(topic.id) or {}
+            data['view_count'] = int(stat.get('views', 0))
+            data['unique_view_count'] = int(stat.get('unique_views', 0))
+            data['like_count'] = int(stat.get('likes', 0))
+            data['comment_count'] = int(stat.get('comments', 0))
+            data['read_count'] = int(stat.get('reads', 0))
+
+        if self.user_id and 'likes' in fields:
+            data['liked_by_me'] = bool(self.liked.get(ident))
+
+        if self.user_id and 'reads' in fields:
+            read = self.reads.get(ident)
+            if read:
+                data['read_by_me'] = read.percent
+
+        webpage = topic.webpage and self.webpages.get(topic.webpage)
+        if webpage:
+            data['webpage'] = dict(webpage)
+            data['link'] = webpage.link
+        return data
+
+
+def hydrate_topics(topics, fields=FIELDS, user_id=None):
+    return HydratedTopics(topics, fields, user_id)
@@ -1,17 +1,19 @@
 # coding: utf-8
 
 import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from flask import current_app
-from sqlalchemy import func
+from sqlalchemy import func, and_
 from sqlalchemy import Column
 from sqlalchemy import String, Unicode, DateTime
 from sqlalchemy import SmallInteger, Integer, UnicodeText
-from zerqu.libs.cache import cache, redis
+from zerqu.libs.cache import redis
 from zerqu.libs.renderer import markup
 from .webpage import WebPage
 from .utils import current_user
 from .base import db, Base, JSON, ARRAY, CACHE_TIMES, RedisStat
+from .base import RedisSeries
+from .base import _collect_cached, _set_cached_many
 
 
 class Topic(Base):
@@ -89,33 +91,13 @@ class Topic(Base):
     def html(self):
         return markup(self.content)
 
-    def get_statuses(self, user_id=None):
-        status = TopicStat(self.id) or {}
-        rv = {
-            'view_count': int(status.get('views', 0)),
-            'like_count': int(status.get('likes', 0)),
-            'comment_count': int(status.get('comments', 0)),
-            'read_count': int(status.get('reads', 0)),
-        }
-        if not user_id:
-            return rv
-
-        key = (self.id, user_id)
-        rv['liked_by_me'] = bool(TopicLike.cache.get(key))
-        read = TopicRead.cache.get(key)
-        if read:
-            rv['read_by_me'] = read.percent
-        else:
-            rv['read_by_me'] = '0%'
-            read = TopicRead(topic_id=self.id, user_id=user_id)
-            with db.auto_commit(throw=False):
-                db.session.add(read)
-        return rv
-
 
 class TopicStat(RedisStat):
     KEY_PREFIX = 'topic_stat:{}'
     TOPIC_FLAGS = 'topic_flags'
+    # topics to be recounted by the reconciliation sweep
+    TOPIC_DIRTY = 'topic_stat:dirty'
+    UNIQUE_FIELDS = ('unique_views',)
 
     def flag(self):
         with redis.pipeline() as pipe:
@@ -125,23 +107,80 @@ class TopicStat(RedisStat):
 
     def keys(self):
         return (
-            'views', 'reads', 'flags', 'likes',
+            'views', 'unique_views', 'reads', 'flags', 'likes',
             'comments', 'reputation', 'timestamp',
         )
 
     def calculate(self):
-        def query_count(model):
-            q = model.query.filter_by(topic_id=self.ident)
-            return q.with_entities(func.count(1)).scalar()
-        redis.hmset(self._key, dict(
-            likes=query_count(TopicLike),
-            reads=query_count(TopicRead),
-            comments=query_count(Comment),
-        ))
+        self.recount([self.ident])
+
+    def mark_dirty(self):
+        redis.sadd(self.TOPIC_DIRTY, self.ident)
+
+    @classmethod
+    def recount(cls, topic_ids):
+        """Count likes, reads and comments of the topics with a grouped
+        query of each model.
+        """
+        cls._recount(topic_ids, lambda column: column.in_(topic_ids))
+
+    @classmethod
+    def recount_range(cls, start, end):
+        """Recount topics of id in [start, end), for rebuilding all."""
+        def where(column):
+            return and_(column >= start, column < end)
+
+        q = db.session.query(Topic.id).filter(where(Topic.id))
+        topic_ids = [i for i, in q]
+        if topic_ids:
+            cls._recount(topic_ids, where)
+        return len(topic_ids)
+
+    @classmethod
+    def _recount(cls, topic_ids, where):
+        stats = {i: dict(likes=0, reads=0, comments=0) for i in topic_ids}
+        for field, model in RECOUNT_MODELS:
+            q = db.session.query(model.topic_id, func.count(1))
+            q = q.filter(where(model.topic_id)).group_by(model.topic_id)
+            for topic_id, count in q:
+                if topic_id in stats:
+                    stats[topic_id][field] = count
+
+        with redis.pipeline() as pipe:
+            for topic_id in stats:
+                pipe.hmset(cls.KEY_PREFIX.format(topic_id), stats[topic_id])
+            pipe.execute()
+
+    @classmethod
+    def reconcile(cls, batch=500):
+        """Recount the dirty topics in batches, run it periodically. The
+        dirty set is claimed by renaming it before the recount, so that
+        topics marked again meanwhile stay dirty for the next round.
+        """
+        processing = cls.TOPIC_DIRTY + ':processing'
+        total = 0
+        while True:
+            # a claimed set left by a failed run is finished first
+            if not redis.exists(processing):
+                if not redis.exists(cls.TOPIC_DIRTY):
+                    return total
+                redis.rename(cls.TOPIC_DIRTY, processing)
+
+            rv = redis.srandmember(processing, batch)
+            topic_ids = [int(i) for i in rv]
+            if topic_ids:
+                cls.recount(topic_ids)
+                redis.srem(processing, *topic_ids)
+                total += len(topic_ids)
+
+
+class TopicSeries(RedisSeries):
+    KEY_PREFIX = 'topic_series:{}'
 
 
 class TopicLike(Base):
     __tablename__ = 'zq_topic_like'
+    __cache_counters__ = ('topic_id',)
 
     topic_id = Column(Integer, primary_key=True, autoincrement=False)
     user_id = Column(Integer, primary_key=True, autoincrement=False)
@@ -152,8 +191,8 @@ class TopicLike(Base):
         self.user_id = user_id
 
     @classmethod
-    def topics_liked_by_user(cls, user_id, topic_ids):
-        return fetch_current_user_items(cls, user_id, topic_ids)
+    def topics_liked_by_user(cls, user_id, topic_ids, batch=None):
+        return fetch_current_user_items(cls, user_id, topic_ids, batch=batch)
 
 
 class TopicRead(Base):
@@ -182,12 +221,13 @@ class TopicRead(Base):
             self._percent = num
 
     @classmethod
-    def topics_read_by_user(cls, user_id, topic_ids):
-        return fetch_current_user_items(cls, user_id, topic_ids)
+    def topics_read_by_user(cls, user_id, topic_ids, batch=None):
+        return fetch_current_user_items(cls, user_id, topic_ids, batch=batch)
 
 
 class Comment(Base):
     __tablename__ = 'zq_comment'
+    __cache_counters__ = ('topic_id',)
 
     id = Column(Integer, primary_key=True)
     content = Column(UnicodeText, nullable=False)
@@ -258,63 +298,36 @@ class CommentLike(Base):
         )
 
 
-def fetch_current_user_items(cls, user_id, ref_ids, key='topic_id'):
+def fetch_current_user_items(cls, user_id, ref_ids, key='topic_id',
+                             batch=None):
     if not ref_ids:
         return {}
 
     prefix = cls.generate_cache_prefix('get')
-
-    def gen_key(tid):
-        return prefix + '-'.join(map(str, [tid, user_id]))
-
-    def get_key(key):
-        return key.lstrip(prefix).split('-')[0]
-
-    rv = cache.get_dict(*[gen_key(tid) for tid in ref_ids])
-    missed = {i for i in ref_ids if rv[gen_key(i)] is None}
-    rv = {get_key(k): rv[k] for k in rv}
-    if not missed:
-        return rv
-
-    to_cache = {}
-    q = cls.cache.filter_by(user_id=user_id)
-    for item in q.filter(getattr(cls, key).in_(missed)):
-        rv[str(getattr(item, key))] = item
-        to_cache[gen_key(getattr(item, key))] = item
-
-    cache.set_many(to_cache, CACHE_TIMES['get'])
+    suffix = '-%s' % user_id
+    ids = OrderedDict((str(i), i) for i in ref_ids)
+    keys = [prefix + k + suffix for k in ids]
+
+    def load(rv, missed):
+        to_cache = {}
+        q = cls.cache.filter_by(user_id=user_id)
+        for item in q.filter(getattr(cls, key).in_(missed)):
+            ident = str(getattr(item, key))
+            rv[ident] = item
+            to_cache[prefix + ident + suffix] = item
+        _set_cached_many(cls, to_cache, CACHE_TIMES['get'])
+
+    if batch is not None:
+        return batch.add(cls, ids, keys, load)
+
+    rv, missed = _collect_cached(cls, ids, keys)
+    if missed:
+        load(rv, missed)
     return rv
 
 
-def iter_topics_with_statuses(topics, user_id):
-    """Update topic list with statuses.
-
-    :param topics: A list of topic dict.
-    :param user_id: Current user ID.
-    """
-    tids = [t['id'] for t in topics]
-    stats = TopicStat.get_dict(tids)
-
-    if user_id:
-        liked = TopicLike.topics_liked_by_user(user_id, tids)
-        reads = TopicRead.topics_read_by_user(user_id, tids)
-    else:
-        liked = None
-        reads = None
-
-    for t in topics:
-        tid = t['id']
-        status = stats.get(tid, {})
-        t['view_count'] = int(status.get('views', 0))
-        t['like_count'] = int(status.get('likes', 0))
-        t['comment_count'] = int(status.get('comments', 0))
-        t['read_count'] = int(status.get('reads', 0))
-
-        tid = str(tid)
-        if liked:
-            t['liked_by_me'] = bool(liked.get(tid))
-        if reads:
-            read = reads.get(tid)
-            if read:
-                t['read_by_me'] = read.percent
-        yield t
+RECOUNT_MODELS = (
+    ('likes', TopicLike),
+    ('reads', TopicRead),
+    ('comments', Comment),
+)
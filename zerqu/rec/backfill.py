@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+Offline backfill of fan-out inboxes, so that inactive users don't wait
+for a rebuild on their next visit. Users are split into shards by
+``user_id % shards`` that can run in parallel. Each shard is processed
+in chunks of user ids, and the last finished user id is saved as a
+checkpoint to resume from.
+
+Backfilled inboxes are kept for BACKFILL_EXPIRE instead of LIST_EXPIRE,
+so that they still exist when a user returns after weeks. The trade-off
+is that every backfilled inbox receives pushes like the inbox of an
+active user until it expires, which is the write cost the lazy build of
+inboxes avoids. Backfill only as far back in activity as is worth that.
+"""
+
+import time
+from collections import defaultdict
+from zerqu.models import db, CafeMember
+from zerqu.libs.cache import redis, ONE_DAY
+from .inbox import inbox_key, fill_list, merge_topic_ids
+from .inbox import get_crowded_cafe_ids, query_cafe_topic_ids
+
+CHECKPOINT_KEY = 'timeline:backfill:{}:{}'
+# backfilled inboxes wait longer for their users than inboxes built on read
+BACKFILL_EXPIRE = ONE_DAY * 30
+
+
+def checkpoint_key(shard, shards):
+    return CHECKPOINT_KEY.format(shards, shard)
+
+
+def iter_user_chunks(shard=0, shards=1, start=0, size=500):
+    """Yield chunks of ids of users following any cafe, after start."""
+    while True:
+        q = db.session.query(CafeMember.user_id).distinct()
+        q = q.filter(CafeMember.role >= CafeMember.ROLE_SUBSCRIBER)
+        q = q.filter(CafeMember.user_id > start)
+        if shards > 1:
+            q = q.filter(CafeMember.user_id % shards == shard)
+        q = q.order_by(CafeMember.user_id).limit(size)
+        user_ids = [user_id for user_id, in q]
+        if not user_ids:
+            return
+        yield user_ids
+        start = user_ids[-1]
+
+
+def backfill_chunk(user_ids, cafe_topics, force=False):
+    """Fill inboxes of the users, existing ones are kept unless force.
+    Topic ids of every cafe are loaded once into ``cafe_topics``.
+    """
+    if not force:
+        with redis.pipeline() as pipe:
+            for user_id in user_ids:
+                pipe.exists(inbox_key(user_id))
+            rv = pipe.execute()
+        user_ids = [i for i, exists in zip(user_ids, rv) if not exists]
+    if not user_ids:
+        return 0
+
+    q = db.session.query(CafeMember.user_id, CafeMember.cafe_id)
+    q = q.filter(CafeMember.user_id.in_(user_ids))
+    q = q.filter(CafeMember.role >= CafeMember.ROLE_SUBSCRIBER)
+    following = defaultdict(set)
+    for user_id, cafe_id in q:
+        following[user_id].add(cafe_id)
+
+    crowded = get_crowded_cafe_ids()
+    with redis.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            lists = []
+            for cafe_id in following[user_id] - crowded:
+                if cafe_id not in cafe_topics:
+                    cafe_topics[cafe_id] = query_cafe_topic_ids([cafe_id])
+                lists.append(cafe_topics[cafe_id])
+            fill_list(
+                inbox_key(user_id), merge_topic_ids(lists), pipe,
+                BACKFILL_EXPIRE,
+            )
+        pipe.execute()
+    return len(user_ids)
+
+
+def backfill_inboxes(shard=0, shards=1, chunk=500, rate=0, force=False):
+    """Backfill inboxes of a shard from its checkpoint.
+
+    :param rate: max users per second, 0 for no limit.
+    :return: count of users scanned and of inboxes filled.
+    """
+    key = checkpoint_key(shard, shards)
+    start = int(redis.get(key) or 0)
+
+    cafe_topics = {}
+    started = time.time()
+    scanned = filled = 0
+    for user_ids in iter_user_chunks(shard, shards, start, chunk):
+        filled += backfill_chunk(user_ids, cafe_topics, force)
+        scanned += len(user_ids)
+        redis.setex(key, ONE_DAY, user_ids[-1])
+        if rate:
+            delay = scanned / float(rate) - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    redis.delete(key)
+    return scanned, filled
+
+
+def reset_checkpoints(shards=1):
+    redis.delete(*[checkpoint_key(i, shards) for i in range(shards)])
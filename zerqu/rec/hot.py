@@ -0,0 +1,129 @@
+# coding: utf-8
+"""
+Popularity ranking of topics in a redis sorted set. The score of a topic
+combines its TopicStat with its creation time::
+
+    log10(weighted points) + (created_at - EPOCH) / DECAY
+
+Newer topics get a higher base, which makes older topics decay without
+rescoring the whole set. A score is recalculated whenever an event
+changes the stat of the topic, except views and reads, which are
+frequent. Topics viewed or read since the last compaction are rescored in
+batch by it.
+"""
+
+import math
+import random
+import calendar
+from zerqu.models import Topic, TopicStat
+from zerqu.libs.cache import redis, counter_buffer
+
+HOT_KEY = 'timeline:hot'
+DIRTY_KEY = 'timeline:hot:dirty'
+# max topics kept in the ranking
+HOT_SIZE = 5000
+WEIGHTS = {
+    'views': 1,
+    'reads': 2,
+    'comments': 4,
+    'likes': 6,
+}
+# 2015-01-01 00:00:00 UTC
+EPOCH = 1420070400
+# every 12.5 hours are worth 10 times points
+DECAY = 45000
+
+
+def calculate_score(stat, created_at):
+    points = sum(int(stat.get(k, 0)) * WEIGHTS[k] for k in WEIGHTS)
+    order = math.log10(max(points, 1))
+    seconds = calendar.timegm(created_at.timetuple()) - EPOCH
+    return round(order + seconds / float(DECAY), 7)
+
+
+def update_hot_score(topic):
+    score = calculate_score(TopicStat(topic.id).value, topic.created_at)
+    redis.zadd(HOT_KEY, score, topic.id)
+    # compact occasionally, instead of on every write
+    if random.random() < 0.01:
+        compact_hot_topics()
+
+
+def mark_hot_dirty(topic_id, buffered=False):
+    """Rescore the topic on next compaction."""
+    if buffered and counter_buffer:
+        counter_buffer.add(DIRTY_KEY, topic_id, command='sadd')
+    else:
+        redis.sadd(DIRTY_KEY, topic_id)
+
+
+def rescore_dirty_topics(chunk=500):
+    with redis.pipeline() as pipe:
+        pipe.smembers(DIRTY_KEY)
+        pipe.delete(DIRTY_KEY)
+        topic_ids = [int(i) for i in pipe.execute()[0]]
+
+    for i in range(0, len(topic_ids), chunk):
+        topics = Topic.cache.get_many(topic_ids[i:i + chunk])
+        stats = TopicStat.get_many([t.id for t in topics])
+        with redis.pipeline(transaction=False) as pipe:
+            for topic, stat in zip(topics, stats):
+                score = calculate_score(stat, topic.created_at)
+                pipe.zadd(HOT_KEY, score, topic.id)
+            pipe.execute()
+    return len(topic_ids)
+
+
+def compact_hot_topics(size=HOT_SIZE):
+    """Trim the lowest ranked topics, keeping reads O(log n)."""
+    return redis.zremrangebyrank(HOT_KEY, 0, -size - 1)
+
+
+def format_hot_cursor(score, topic_id):
+    return '%r:%d' % (score, topic_id)
+
+
+def parse_hot_cursor(cursor):
+    """Parse a cursor of ``score:id``, raise ValueError if invalid."""
+    score, topic_id = cursor.split(':')
+    score = float(score)
+    if math.isnan(score) or math.isinf(score):
+        raise ValueError('score must be finite')
+    return score, int(topic_id)
+
+
+def get_hot_topics(cursor=None, count=20):
+    """Topics ordered by popularity. The cursor is the score and id of the
+    last topic, so that pages don't shift when topics are added or
+    rescored before it. An empty cursor or ``'0'`` is the first page.
+    """
+    if cursor == '0':
+        cursor = None
+    if cursor:
+        score, last_id = parse_hot_cursor(cursor)
+        upper = repr(score)
+        last = str(last_id).encode('utf-8')
+    else:
+        upper = '+inf'
+
+    items = []
+    offset = 0
+    while len(items) < count:
+        rv = redis.zrevrangebyscore(
+            HOT_KEY, upper, '-inf', start=offset, num=count, withscores=True
+        )
+        for member, value in rv:
+            # members of one score are in descending order
+            if cursor and value == score and member >= last:
+                continue
+            items.append((int(member), value))
+        if len(rv) < count:
+            break
+        offset += count
+
+    items = items[:count]
+    topics = Topic.cache.get_many([topic_id for topic_id, _ in items])
+    if len(items) < count:
+        return topics, 0
+    topic_id, value = items[-1]
+    return topics, format_hot_cursor(value, topic_id)
@@ -0,0 +1,224 @@
+# coding: utf-8
+"""
+Redis sorted sets of topic ids for the fan-out-on-write timeline. Each
+public cafe has a capped list, and each active user has a capped inbox
+which is filled when a topic is published in a cafe the user follows.
+Topic ids are both the members and the scores.
+
+Lists are only pushed into when they exist, and a push keeps them for
+another LIST_EXPIRE. A missing list is built from the database on read,
+so that inactive users cost nothing on write.
+"""
+
+import heapq
+from flask import current_app
+from sqlalchemy import func
+from zerqu.models import db, CafeMember, CafeTopic
+from zerqu.libs.cache import redis, cached, ONE_DAY
+
+# max topic ids kept in every list
+LIST_SIZE = 800
+LIST_EXPIRE = ONE_DAY * 7
+# cafes with more followers are merged on read instead of fan-out
+FANOUT_LIMIT = 2000
+
+# timeline engines reading the cafe lists, only fanout reads inboxes
+ENGINES = ('fanout', 'merge')
+
+CAFE_KEY = 'timeline:cafe:{}'
+INBOX_KEY = 'timeline:inbox:{}'
+
+# cafe lists built in one query and pipeline
+FILL_CHUNK = 100
+
+# lists being pushed into are kept for at least ARGV[3] seconds
+PUSH_SCRIPT = '''
+for i, key in ipairs(KEYS) do
+    if redis.call('exists', key) == 1 then
+        redis.call('zadd', key, ARGV[1], ARGV[1])
+        redis.call('zremrangebyrank', key, 0, -tonumber(ARGV[2]) - 1)
+        if redis.call('ttl', key) < tonumber(ARGV[3]) then
+            redis.call('expire', key, ARGV[3])
+        end
+    end
+end
+'''
+
+
+def cafe_key(cafe_id):
+    return CAFE_KEY.format(cafe_id)
+
+
+def inbox_key(user_id):
+    return INBOX_KEY.format(user_id)
+
+
+def get_engine():
+    return current_app.config.get('ZERQU_TIMELINE_ENGINE')
+
+
+@cached('timeline:crowded_cafe_ids')
+def get_crowded_cafe_ids():
+    """Cafes with too many followers to fan out."""
+    q = db.session.query(CafeMember.cafe_id)
+    q = q.filter(CafeMember.role >= CafeMember.ROLE_SUBSCRIBER)
+    q = q.group_by(CafeMember.cafe_id)
+    q = q.having(func.count(CafeMember.user_id) > FANOUT_LIMIT)
+    return {cafe_id for cafe_id, in q}
+
+
+def get_cafe_follower_ids(cafe_id):
+    q = db.session.query(CafeMember.user_id).filter_by(cafe_id=cafe_id)
+    q = q.filter(CafeMember.role >= CafeMember.ROLE_SUBSCRIBER)
+    return [user_id for user_id, in q]
+
+
+def get_fanout_cafe_ids(user_id):
+    """Cafes whose topics are pushed into the inbox of the user."""
+    following = CafeMember.get_user_following_cafe_ids(user_id)
+    return following - get_crowded_cafe_ids()
+
+
+def query_cafe_topic_ids(cafe_ids, count=LIST_SIZE):
+    if not cafe_ids:
+        return []
+    q = db.session.query(CafeTopic.topic_id)
+    q = q.filter(CafeTopic.cafe_id.in_(cafe_ids))
+    q = q.filter_by(status=CafeTopic.STATUS_PUBLIC)
+    q = q.order_by(CafeTopic.topic_id.desc()).limit(count)
+    return [topic_id for topic_id, in q]
+
+
+def query_cafe_lists(cafe_ids, count=LIST_SIZE):
+    """Topic ids of every cafe in descending order, in one query."""
+    rank = func.row_number().over(
+        partition_by=CafeTopic.cafe_id,
+        order_by=CafeTopic.topic_id.desc(),
+    ).label('rank')
+    q = db.session.query(CafeTopic.cafe_id, CafeTopic.topic_id, rank)
+    q = q.filter(CafeTopic.cafe_id.in_(cafe_ids))
+    q = q.filter_by(status=CafeTopic.STATUS_PUBLIC)
+    sub = q.subquery()
+
+    q = db.session.query(sub.c.cafe_id, sub.c.topic_id)
+    q = q.filter(sub.c.rank <= count)
+    q = q.order_by(sub.c.cafe_id, sub.c.topic_id.desc())
+    rv = {cafe_id: [] for cafe_id in cafe_ids}
+    for cafe_id, topic_id in q:
+        rv[cafe_id].append(topic_id)
+    return rv
+
+
+def fill_list(key, topic_ids, pipe=None, expire=LIST_EXPIRE):
+    if pipe is None:
+        with redis.pipeline() as pipe:
+            fill_list(key, topic_ids, pipe, expire)
+            return pipe.execute()
+
+    pipe.delete(key)
+    # with a placeholder of score 0, so that an empty list exists
+    args = [0, 0]
+    for i in topic_ids:
+        args.extend([i, i])
+    pipe.zadd(key, *args)
+    pipe.expire(key, expire)
+
+
+def ensure_cafe_lists(cafe_ids):
+    cafe_ids = list(cafe_ids)
+    keys = [cafe_key(cafe_id) for cafe_id in cafe_ids]
+    with redis.pipeline() as pipe:
+        for key in keys:
+            pipe.exists(key)
+        rv = pipe.execute()
+
+    missing = [i for i, exists in zip(cafe_ids, rv) if not exists]
+    for i in range(0, len(missing), FILL_CHUNK):
+        lists = query_cafe_lists(missing[i:i + FILL_CHUNK])
+        with redis.pipeline(transaction=False) as pipe:
+            for cafe_id in lists:
+                fill_list(cafe_key(cafe_id), lists[cafe_id], pipe)
+            pipe.execute()
+    return keys
+
+
+def ensure_inbox(user_id):
+    key = inbox_key(user_id)
+    if not redis.exists(key):
+        rebuild_inbox(user_id)
+    return key
+
+
+def rebuild_inbox(user_id):
+    cafe_ids = get_fanout_cafe_ids(user_id)
+    fill_list(inbox_key(user_id), query_cafe_topic_ids(cafe_ids))
+
+
+def drop_inbox(user_id):
+    """Drop the inbox, it will be rebuilt on next read."""
+    redis.delete(inbox_key(user_id))
+
+
+def push_topic(cafe_id, topic_id, inboxes=True):
+    """Push a topic published in the cafe into the list of the cafe, and
+    fan it out to the inboxes of followers if ``inboxes``.
+    """
+    keys = [cafe_key(cafe_id)]
+    if inboxes and cafe_id not in get_crowded_cafe_ids():
+        user_ids = get_cafe_follower_ids(cafe_id)
+        keys.extend(inbox_key(user_id) for user_id in user_ids)
+
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        args = chunk + [topic_id, LIST_SIZE, LIST_EXPIRE]
+        redis.eval(PUSH_SCRIPT, len(chunk), *args)
+
+
+def merge_topic_ids(lists, count=LIST_SIZE):
+    """Merge descending lists of topic ids without duplicates."""
+    rv = []
+    for i in heapq.merge(*[[-i for i in ids] for ids in lists]):
+        if rv and rv[-1] == -i:
+            continue
+        rv.append(-i)
+        if len(rv) == count:
+            break
+    return rv
+
+
+def read_lists(keys, cursor=None, count=20):
+    """Read topic ids lower than cursor from the lists, merged lazily in
+    descending order without duplicates.
+    """
+    if cursor:
+        upper = '(%d' % cursor
+    else:
+        upper = '+inf'
+
+    with redis.pipeline() as pipe:
+        for key in keys:
+            pipe.zrevrangebyscore(key, upper, '(0', start=0, num=count)
+        chunks = pipe.execute()
+
+    # heapq.merge yields the smallest first, ids are negated
+    iterators = [
+        _iter_list(key, chunk, count) for key, chunk in zip(keys, chunks)
+    ]
+    topic_ids = []
+    for i in heapq.merge(*iterators):
+        if topic_ids and topic_ids[-1] == -i:
+            continue
+        topic_ids.append(-i)
+        if len(topic_ids) == count:
+            break
+    return topic_ids
+
+
+def _iter_list(key, chunk, count):
+    while True:
+        for i in chunk:
+            yield -int(i)
+        if len(chunk) < count:
+            return
+        upper = '(%d' % int(chunk[-1])
+        chunk = redis.zrevrangebyscore(key, upper, '(0', start=0, num=count)
@@ -0,0 +1,84 @@
+# coding: utf-8
+"""
+Random sampling of public cafes for the timeline, weighted by activity.
+Eligible cafes are kept in a redis set, and their activity (count of
+published topics) in a sorted set. Both are maintained by model events
+and built from the database when missing.
+"""
+
+import math
+import random
+from sqlalchemy import func
+from zerqu.models import db, Cafe, CafeTopic
+from zerqu.libs.cache import redis
+
+CAFES_KEY = 'timeline:sample_cafes'
+ACTIVITY_KEY = 'timeline:cafe_activity'
+# uniform candidates drawn for each sampled cafe
+OVERSAMPLE = 3
+
+
+def is_eligible(cafe):
+    return cafe.permission == Cafe.PERMISSION_PUBLIC
+
+
+def rebuild_sampler():
+    q = db.session.query(Cafe.id)
+    q = q.filter_by(permission=Cafe.PERMISSION_PUBLIC)
+    cafe_ids = [cafe_id for cafe_id, in q]
+
+    q = db.session.query(CafeTopic.cafe_id, func.count(CafeTopic.topic_id))
+    q = q.filter_by(status=CafeTopic.STATUS_PUBLIC)
+    q = q.group_by(CafeTopic.cafe_id)
+    activity = []
+    for cafe_id, count in q:
+        activity.extend([count, cafe_id])
+
+    with redis.pipeline() as pipe:
+        pipe.delete(CAFES_KEY, ACTIVITY_KEY)
+        if cafe_ids:
+            pipe.sadd(CAFES_KEY, *cafe_ids)
+        if activity:
+            pipe.zadd(ACTIVITY_KEY, *activity)
+        pipe.execute()
+    return cafe_ids
+
+
+def update_sample_cafe(cafe):
+    """Add or remove the cafe when its permission changed."""
+    if not redis.exists(CAFES_KEY):
+        return
+    if is_eligible(cafe):
+        redis.sadd(CAFES_KEY, cafe.id)
+    else:
+        redis.srem(CAFES_KEY, cafe.id)
+
+
+def increase_activity(cafe_id, step=1):
+    redis.zincrby(ACTIVITY_KEY, cafe_id, step)
+
+
+def sample_cafe_ids(count=6, threshold=8):
+    """Sample public cafes, more active cafes are more likely to be
+    chosen. All of them are returned if there are no more than threshold.
+    """
+    if not redis.exists(CAFES_KEY):
+        rebuild_sampler()
+
+    candidates = redis.srandmember(CAFES_KEY, max(threshold, count) + 1)
+    if len(candidates) <= threshold:
+        return {int(i) for i in candidates}
+
+    candidates = redis.srandmember(CAFES_KEY, count * OVERSAMPLE)
+    with redis.pipeline() as pipe:
+        for cafe_id in candidates:
+            pipe.zscore(ACTIVITY_KEY, cafe_id)
+        scores = pipe.execute()
+
+    # weighted sampling without replacement, by Efraimidis and Spirakis
+    keys = []
+    for cafe_id, score in zip(candidates, scores):
+        weight = 1 + math.log1p(score or 0)
+        keys.append((random.random() ** (1 / weight), int(cafe_id)))
+    keys.sort(reverse=True)
+    return {cafe_id for _, cafe_id in keys[:count]}
@@ -1,9 +1,13 @@
 # coding: utf-8
 
-import random
+import hashlib
+from flask import current_app
 from zerqu.models import db, Topic, Cafe, CafeMember, CafeTopic
-from zerqu.libs.cache import cached
-# TODO: use redis to calculate popularity
+from zerqu.libs.cache import cache, cached
+from zerqu.libs.cache import ONE_DAY, ONE_MINUTE, TEN_MINUTES
+from .inbox import ensure_inbox, ensure_cafe_lists, read_lists
+from .inbox import get_fanout_cafe_ids, merge_topic_ids, ENGINES
+from .sampler import sample_cafe_ids
 
 
 def get_timeline_topics(cursor=None, user_id=None, count=20):
@@ -12,9 +16,52 @@ def get_timeline_topics(cursor=None, user_id=None, count=20):
     else:
         cafe_ids = get_promoted_cafe_ids()
 
+    engine = current_app.config.get('ZERQU_TIMELINE_ENGINE')
+    if engine == 'fanout':
+        topic_ids = get_fanout_topic_ids(cafe_ids, user_id, cursor, count)
+    elif engine == 'merge':
+        topic_ids = get_merged_topic_ids(cafe_ids, cursor, count)
+    else:
+        topic_ids = get_cafe_topic_ids(cafe_ids, cursor, count)
+
     if len(cafe_ids) < 10:
-        cafe_ids = get_random_cafe_ids() | cafe_ids
-    return get_cafe_topics(cafe_ids, cursor, count)
+        # random cafes change on every request, they are merged after
+        # the page is read, so that they don't miss the page cache
+        random_ids = get_random_cafe_ids() - cafe_ids
+        if random_ids:
+            extra_ids = get_sampled_topic_ids(
+                engine, random_ids, cursor, count
+            )
+            topic_ids = merge_topic_ids([topic_ids, extra_ids], count)
+    return _fetch_topics(topic_ids, count)
+
+
+def get_fanout_topic_ids(cafe_ids, user_id=None, cursor=None, count=20):
+    """Read the timeline from the inbox of the user, merged with the
+    lists of the other cafes, e.g. official cafes and crowded cafes.
+    """
+    keys = []
+    if user_id:
+        keys.append(ensure_inbox(user_id))
+        cafe_ids = cafe_ids - get_fanout_cafe_ids(user_id)
+    keys.extend(ensure_cafe_lists(cafe_ids))
+    return read_lists(keys, cursor, count)
+
+
+def get_merged_topic_ids(cafe_ids, cursor=None, count=20):
+    """Merge the topic lists of every cafe with a heap."""
+    def merge():
+        keys = ensure_cafe_lists(cafe_ids)
+        return read_lists(keys, cursor, count)
+
+    return _get_page_ids('merge', cafe_ids, cursor, count, merge)
+
+
+def _fetch_topics(topic_ids, count):
+    topics = Topic.cache.get_many(topic_ids)
+    if len(topic_ids) < count:
+        return topics, 0
+    return topics, topic_ids[-1]
 
 
 def get_all_topics(cursor=None, count=20):
@@ -31,14 +78,21 @@ def get_all_topics(cursor=None, count=20):
     return topics, topic_ids[-1]
 
 
-@cached('timeline:following_cafe_ids:%s')
 def get_following_cafe_ids(user_id):
-    q = db.session.query(Cafe.id).filter_by(status=Cafe.STATUS_OFFICIAL)
-    official = {cafe_id for cafe_id, in q}
     following = CafeMember.get_user_following_cafe_ids(user_id)
+    return get_official_cafe_ids() | following | get_owned_cafe_ids(user_id)
+
+
+@cached('timeline:official_cafe_ids')
+def get_official_cafe_ids():
+    q = db.session.query(Cafe.id).filter_by(status=Cafe.STATUS_OFFICIAL)
+    return {cafe_id for cafe_id, in q}
+
+
+@cached('timeline:owned_cafe_ids:%s', expire=ONE_DAY)
+def get_owned_cafe_ids(user_id):
     q = db.session.query(Cafe.id).filter_by(user_id=user_id)
-    mine = {cafe_id for cafe_id, in q}
-    return official | following | mine
+    return {cafe_id for cafe_id, in q}
 
 
 @cached('timeline:promoted_cafe_ids')
@@ -48,15 +102,9 @@ def get_promoted_cafe_ids():
     return {cafe_id for cafe_id, in q}
 
 
-@cached('timeline:random_cafe_ids')
 def get_random_cafe_ids():
-    # random sample some public cafes
-    q = db.session.query(Cafe.id)
-    q = q.filter_by(permission=Cafe.PERMISSION_PUBLIC)
-    choices = {cafe_id for cafe_id, in q}
-    if len(choices) > 8:
-        return set(random.sample(choices, 6))
-    return choices
+    # random sample some public cafes, on every request
+    return sample_cafe_ids(6)
 
 
 @cached('timeline:all_cafe_ids')
@@ -65,15 +113,65 @@ def get_all_cafe_ids():
     return {cafe_id for cafe_id, in q}
 
 
-def get_cafe_topics(cafe_ids, cursor=None, count=20):
+def query_topic_ids(cafe_ids, cursor=None, count=20):
+    if not cafe_ids:
+        return []
     q = db.session.query(CafeTopic.topic_id)
     q = q.filter(CafeTopic.cafe_id.in_(cafe_ids))
     if cursor:
         q = q.filter(CafeTopic.topic_id < cursor)
+    # a topic can be in several cafes
+    q = q.distinct().order_by(CafeTopic.topic_id.desc()).limit(count)
+    return [i for i, in q]
 
-    q = q.order_by(CafeTopic.topic_id.desc()).limit(count)
-    topic_ids = {i for i, in q}
-    topics = Topic.cache.get_many(topic_ids)
-    if not topics:
-        return [], 0
-    return topics, topics[-1].id
+
+def get_cafe_topic_ids(cafe_ids, cursor=None, count=20):
+    def query():
+        return query_topic_ids(cafe_ids, cursor, count)
+
+    return _get_page_ids('sql', cafe_ids, cursor, count, query)
+
+
+def get_sampled_topic_ids(engine, cafe_ids, cursor=None, count=20):
+    """Topic ids of randomly sampled cafes. They are read from the cafe
+    lists by the list engines, and from pages cached per cafe by the sql
+    engine, so that any sample reuses them.
+    """
+    if engine in ENGINES:
+        return read_lists(ensure_cafe_lists(cafe_ids), cursor, count)
+
+    cafe_ids = sorted(cafe_ids)
+    keys = [_page_key('sql', [i], cursor, count) for i in cafe_ids]
+    lists = []
+    for cafe_id, key, topic_ids in zip(cafe_ids, keys, cache.get_many(*keys)):
+        if topic_ids is None:
+            topic_ids = query_topic_ids([cafe_id], cursor, count)
+            cache.set(key, topic_ids, _page_timeout(cursor))
+        lists.append(topic_ids)
+    return merge_topic_ids(lists, count)
+
+
+def _page_key(engine, cafe_ids, cursor, count):
+    digest = hashlib.md5(
+        ','.join(map(str, sorted(cafe_ids))).encode('utf-8')
+    ).hexdigest()
+    return 'timeline:page:%s:%s:%d:%d' % (engine, digest, cursor or 0, count)
+
+
+def _page_timeout(cursor):
+    # the first page changes often, it expires sooner
+    if cursor:
+        return TEN_MINUTES
+    return ONE_MINUTE
+
+
+def _get_page_ids(engine, cafe_ids, cursor, count, load):
+    """Topic ids of a timeline page, shared by everyone reading the same
+    set of cafes.
+    """
+    key = _page_key(engine, cafe_ids, cursor, count)
+    topic_ids = cache.get(key)
+    if topic_ids is None:
+        topic_ids = load()
+        cache.set(key, topic_ids, _page_timeout(cursor))
+    return topic_ids
@@ -16,6 +16,23 @@ ZERQU_CACHE_TYPE = 'redis'
 ZERQU_CACHE_REDIS_DB = 2
 ZERQU_REDIS_URI = 'redis://localhost:6379/0'
 
+# in-process LRU cache in front of the shared cache, 0 to disable
+ZERQU_LOCAL_CACHE_SIZE = 0
+ZERQU_LOCAL_CACHE_TIMEOUT = 60
+# redis pub/sub channel for dropping stale local cache entries
+ZERQU_CACHE_CHANNEL = 'cache:invalidate'
+# how model instances are stored in cache: tuple or pickle
+ZERQU_CACHE_CODEC = 'tuple'
+# record cache statistics per key family, exported every interval seconds
+ZERQU_CACHE_STATS = True
+ZERQU_CACHE_STATS_INTERVAL = 60
+# send the count of shared cache calls of a request in a response header
+ZERQU_CACHE_ROUND_TRIPS_HEADER = False
+# buffer view counters in process, written every interval seconds or when
+# size counters are pending, 0 to write every view
+ZERQU_COUNTER_FLUSH_INTERVAL = 5
+ZERQU_COUNTER_FLUSH_SIZE = 1000
+
 BABEL_DEFAULT_LOCALE = 'en'
 BABEL_LOCALES = ['en', 'zh']
 
@@ -35,3 +52,7 @@ ZERQU_VALID_MODIFY_TIME = 3600
 ZERQU_TEXT_RENDERER = 'markdown'
 
 ZERQU_CAFE_CREATOR_ROLES = [4, 7, 8, 9]
+
+# how timeline is read: sql, fanout from redis inboxes,
+# or merge of redis cafe lists
+ZERQU_TIMELINE_ENGINE = 'sql'